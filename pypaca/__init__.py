@@ -35,5 +35,33 @@ class ObservatoryError(Exception):
 ##-------------------------------------------------------------------------
 ## Import Local
 ##-------------------------------------------------------------------------
-from .devices import Focuser, FilterWheel, Telescope, Camera
-from .observatory import Observatory, Sequence
+# Submodules and the classes exported here are imported on first use, so
+# that e.g. a script which only talks to a Telescope does not pay for
+# importing astropy.
+import importlib
+
+_lazy = {'Focuser': 'devices',
+         'FilterWheel': 'devices',
+         'Telescope': 'devices',
+         'Camera': 'devices',
+         'Dome': 'devices',
+         'SafetyMonitor': 'devices',
+         'ObservingConditions': 'devices',
+         'Rotator': 'devices',
+         'Switch': 'devices',
+         'Observatory': 'observatory',
+         'Sequence': 'observatory',
+        }
+_submodules = ['cli', 'demosaic', 'devices', 'journal', 'observatory',
+               'planner', 'proxy', 'services', 'telemetry', 'transport']
+
+def __getattr__(name):
+    if name in _lazy:
+        module = importlib.import_module(f'.{_lazy[name]}', __name__)
+        return getattr(module, name)
+    if name in _submodules:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_lazy.keys()) + _submodules)
@@ -0,0 +1,175 @@
+#!/usr/env/python
+import argparse
+import logging
+import subprocess
+import sys
+import time
+
+from . import log, LogConsoleHandler
+
+##-------------------------------------------------------------------------
+## Command Line Interface
+##-------------------------------------------------------------------------
+# Properties printed by the status command for each device type
+STATUS = {'telescope': ['rightascension', 'declination', 'altitude',
+                        'azimuth', 'tracking', 'slewing', 'atpark',
+                        'sideofpier'],
+          'camera': ['camerastate', 'ccdtemperature', 'coolerpower',
+                     'binx', 'biny', 'gain'],
+          'focuser': ['position', 'ismoving', 'temperature', 'tempcomp'],
+          'filterwheel': ['position', 'names'],
+          'dome': ['azimuth', 'shutterstatus', 'slewing', 'atpark', 'slaved'],
+          'safetymonitor': ['issafe'],
+          'observingconditions': ['temperature', 'humidity', 'dewpoint',
+                                  'windspeed', 'windgust', 'rainrate',
+                                  'cloudcover', 'skyquality'],
+          'rotator': ['position', 'ismoving', 'reverse'],
+         }
+
+# Modules timed by the import benchmark, with the heavy modules which they
+# should not pull in
+BENCHMARK = [('pypaca', ['astropy', 'numpy', 'requests', 'yaml']),
+             ('pypaca.devices', ['astropy', 'numpy']),
+             ('pypaca.observatory', []),
+            ]
+
+
+def quick_device(args):
+    """A Device without the usual description queries, for one off GETs."""
+    from .devices import Device
+    return Device(args.ip, port=args.port, device=args.device,
+                  device_number=args.number, describe=False)
+
+
+def status(args):
+    d = quick_device(args)
+    for command in STATUS.get(args.device, ['connected', 'name']):
+        print(f"{command:>16s}: {d.get(command, quiet=True)['Value']}")
+
+
+def get(args):
+    d = quick_device(args)
+    print(d.get(args.command, quiet=True)['Value'])
+
+
+def expose(args):
+    from .observatory import Observatory
+    obs = Observatory(configfile=args.config)
+    obs.connect_all()
+    obs.targname = args.targname
+    obs.expose(exptime=args.exptime, filter=args.filter, imtype=args.imtype,
+               filename=args.output)
+
+
+def run(args):
+    from .observatory import Observatory, Sequence
+    obs = Observatory(configfile=args.config)
+    obs.connect_all()
+    seq = Sequence()
+    seq.read(args.sequence)
+    files = obs.run_sequence(seq, outdir=args.outdir,
+                             resume=not args.restart, verify=args.verify)
+    log.info(f'Wrote {len(files)} frames to {args.outdir}')
+
+
+def proxy(args):
+    from .proxy import AlpacaProxy
+    p = AlpacaProxy(args.ip, port=args.port, host=args.host,
+                    listen_port=args.listen_port, ttl=args.ttl)
+    p.start()
+    try:
+        while True:
+            time.sleep(60)
+            log.info(f'Proxy stats: {p.stats()}')
+    except KeyboardInterrupt:
+        p.stop()
+
+
+def benchmark_import(args):
+    """Time a fresh import of each module in a new interpreter and check
+    which heavy dependencies it loaded.
+    """
+    failed = False
+    for module, forbidden in BENCHMARK:
+        code = (f"import sys, time; t0 = time.perf_counter(); "
+                f"import {module}; t = time.perf_counter() - t0; "
+                f"print(t, ' '.join(m for m in {forbidden!r} "
+                f"if m in sys.modules))")
+        times = []
+        for i in range(args.repeat):
+            out = subprocess.run([sys.executable, '-c', code], check=True,
+                                 capture_output=True, text=True).stdout
+            t, _, loaded = out.strip().partition(' ')
+            times.append(float(t))
+        best = min(times) * 1000
+        note = f'  loaded {loaded}' if loaded else ''
+        print(f'{module:>20s}: {best:7.1f} ms{note}')
+        if args.limit is not None and best > args.limit:
+            failed = True
+        if loaded:
+            failed = True
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog='pypaca',
+                                description='ASCOM Alpaca command line tools')
+    p.add_argument('-v', '--verbose', action='store_true',
+                   help='show debug logging')
+    sub = p.add_subparsers(dest='action', required=True)
+
+    def add_device_args(parser):
+        parser.add_argument('device', choices=['switch', 'safetymonitor',
+                            'dome', 'camera', 'observingconditions',
+                            'filterwheel', 'focuser', 'rotator', 'telescope'])
+        parser.add_argument('--ip', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=11111)
+        parser.add_argument('--number', type=int, default=0,
+                            help='Alpaca device number')
+
+    s = sub.add_parser('status', help='print the state of a device')
+    add_device_args(s)
+    s.set_defaults(func=status)
+
+    s = sub.add_parser('get', help='GET one property of a device')
+    add_device_args(s)
+    s.add_argument('command', help='Alpaca property, e.g. rightascension')
+    s.set_defaults(func=get)
+
+    s = sub.add_parser('expose', help='take one exposure with Camera1')
+    s.add_argument('--config', default=None, help='Observatory config file')
+    s.add_argument('--exptime', type=float, default=0)
+    s.add_argument('--filter', default='L')
+    s.add_argument('--imtype', default='light')
+    s.add_argument('--targname', default='')
+    s.add_argument('--output', default=None, help='FITS file to write')
+    s.set_defaults(func=expose)
+
+    s = sub.add_parser('run', help='run a sequence file')
+    s.add_argument('sequence', help='sequence file (see ExampleSequence.txt)')
+    s.add_argument('--config', default=None, help='Observatory config file')
+    s.add_argument('--outdir', default='.')
+    s.add_argument('--restart', action='store_true',
+                   help='ignore the journal and take every frame again')
+    s.add_argument('--verify', action='store_true',
+                   help='check the checksums of frames already written')
+    s.set_defaults(func=run)
+
+    s = sub.add_parser('proxy', help='run a multiplexing Alpaca proxy')
+    s.add_argument('--ip', default='127.0.0.1', help='upstream Alpaca server')
+    s.add_argument('--port', type=int, default=11111)
+    s.add_argument('--host', default='127.0.0.1', help='address to serve on')
+    s.add_argument('--listen-port', type=int, default=11112)
+    s.add_argument('--ttl', type=float, default=0.5)
+    s.set_defaults(func=proxy)
+
+    s = sub.add_parser('benchmark-import', help='time importing pypaca')
+    s.add_argument('--repeat', type=int, default=5)
+    s.add_argument('--limit', type=float, default=None,
+                   help='fail if any import takes longer (ms)')
+    s.set_defaults(func=benchmark_import)
+
+    args = p.parse_args(argv)
+    if args.verbose is True:
+        LogConsoleHandler.setLevel(logging.DEBUG)
+    return args.func(args)
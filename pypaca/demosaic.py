@@ -0,0 +1,162 @@
+#!/usr/env/python
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import log, ObservatoryError
+
+##-------------------------------------------------------------------------
+## Bayer Demosaic
+##-------------------------------------------------------------------------
+# Alpaca SensorType value for an RGGB Bayer sensor.  Other color sensor types
+# (CMYG, CMYG2, LRGB) are not handled here.
+SENSORTYPE_RGGB = 2
+
+# Bilinear kernels, applied to a sparse (zero filled) color plane
+KERNEL_RB = np.array([[1, 2, 1], [2, 4, 2], [1, 2, 1]], dtype=np.float32) / 4
+KERNEL_G = np.array([[0, 1, 0], [1, 4, 1], [0, 1, 0]], dtype=np.float32) / 4
+
+# Pixels of halo around each block.  Must be even so every block starts on
+# the same Bayer phase as the full frame, and large enough for the 5x5
+# footprint of the edge aware green estimate plus the 3x3 color difference
+# step that follows it.
+PAD = 4
+
+
+def bayer_phase(bayeroffsetx, bayeroffsety, startx=0, starty=0):
+    """Return the (x, y) phase of pixel [0, 0] of a (sub)frame within the
+    RGGB pattern.  Phase (0, 0) means pixel [0, 0] is red.
+    """
+    return ((bayeroffsetx + startx) % 2, (bayeroffsety + starty) % 2)
+
+
+def _conv3(a, kernel):
+    """3x3 correlation by slicing.  The result is one pixel smaller than a on
+    each edge.
+    """
+    h, w = a.shape
+    out = np.zeros((h - 2, w - 2), dtype=np.float32)
+    for dy in range(3):
+        for dx in range(3):
+            k = kernel[dy, dx]
+            if k != 0:
+                out += k * a[dy:h-2+dy, dx:w-2+dx]
+    return out
+
+
+def _sparse(a, y0, x0):
+    """Zero filled copy of a keeping only every other pixel starting at
+    (y0, x0).
+    """
+    s = np.zeros_like(a)
+    s[y0::2, x0::2] = a[y0::2, x0::2]
+    return s
+
+
+def _masks(shape, phase):
+    px, py = phase
+    red = np.zeros(shape, dtype=bool)
+    red[py::2, px::2] = True
+    blue = np.zeros(shape, dtype=bool)
+    blue[1-py::2, 1-px::2] = True
+    return red, blue
+
+
+def _bilinear(p, phase):
+    """Demosaic a padded block.  Returns an array of shape (3, h-2, w-2)."""
+    px, py = phase
+    red = _sparse(p, py, px)
+    blue = _sparse(p, 1-py, 1-px)
+    green = p - red - blue
+    return np.stack([_conv3(red, KERNEL_RB),
+                     _conv3(green, KERNEL_G),
+                     _conv3(blue, KERNEL_RB)])
+
+
+def _edge_aware(p, phase):
+    """Hamilton-Adams style demosaic of a padded block.  Green is interpolated
+    along the direction with the smaller gradient (with a second derivative
+    correction from the co-sited color), then red and blue are interpolated
+    bilinearly as color differences from green.  Returns an array of shape
+    (3, h-2, w-2).
+    """
+    h, w = p.shape
+    red, blue = _masks(p.shape, phase)
+    green_site = ~(red | blue)
+
+    # Direction aware green estimate for the interior (h-4, w-4) region
+    c = p[2:-2, 2:-2]
+    west, east = p[2:-2, 1:-3], p[2:-2, 3:-1]
+    north, south = p[1:-3, 2:-2], p[3:-1, 2:-2]
+    d2h = 2*c - p[2:-2, :-4] - p[2:-2, 4:]
+    d2v = 2*c - p[:-4, 2:-2] - p[4:, 2:-2]
+    grad_h = np.abs(west - east) + np.abs(d2h)
+    grad_v = np.abs(north - south) + np.abs(d2v)
+    g_h = (west + east) / 2 + d2h / 4
+    g_v = (north + south) / 2 + d2v / 4
+    g_est = np.where(grad_h < grad_v, g_h,
+                     np.where(grad_v < grad_h, g_v, (g_h + g_v) / 2))
+
+    # Full green plane on the padded grid.  The outer two rings keep the raw
+    # value, they are outside the halo needed for the output pixels.
+    g = p.copy()
+    g[2:-2, 2:-2] = np.where(green_site[2:-2, 2:-2], c, g_est)
+
+    rgb = np.empty((3, h - 2, w - 2), dtype=np.float32)
+    rgb[1] = g[1:-1, 1:-1]
+    for i, mask in [(0, red), (2, blue)]:
+        diff = np.where(mask, p - g, 0).astype(np.float32)
+        rgb[i] = g[1:-1, 1:-1] + _conv3(diff, KERNEL_RB)
+    return rgb
+
+
+methods = {'bilinear': _bilinear,
+           'edge': _edge_aware,
+           }
+
+
+def _demosaic_block(raw, r0, r1, phase, method):
+    ny = raw.shape[0]
+    top = max(r0 - PAD, 0)
+    bottom = min(r1 + PAD, ny)
+    block = raw[top:bottom].astype(np.float32)
+    # Reflection keeps the Bayer parity of the mirrored rows and columns
+    block = np.pad(block, ((PAD - (r0 - top), PAD - (bottom - r1)),
+                           (PAD, PAD)), mode='reflect')
+    rgb = methods[method](block, phase)
+    # The methods trim one pixel from each edge, trim the rest of the halo
+    return rgb[:, PAD-1:1-PAD, PAD-1:1-PAD]
+
+
+def demosaic(raw, phase=(0, 0), method='bilinear', block_rows=256,
+             workers=None):
+    """Demosaic an RGGB frame indexed [y, x].
+
+    phase is the (x, y) position of pixel [0, 0] within the RGGB pattern (see
+    bayer_phase).  The frame is processed in blocks of block_rows rows on a
+    thread pool so the working memory stays bounded by the block size.
+    Returns a float32 cube of shape (3, ny, nx) ordered R, G, B.
+    """
+    if method not in methods:
+        raise ObservatoryError(f'Unknown demosaic method "{method}"')
+    ny, nx = raw.shape
+    if ny < 2*PAD or nx < 2*PAD:
+        raise ObservatoryError(f'Frame of shape {raw.shape} too small to demosaic')
+    # Blocks start on even rows so they share the frame's Bayer phase
+    block_rows = max(2*PAD, block_rows + block_rows % 2)
+    starts = list(range(0, ny, block_rows))
+    if len(starts) > 1 and ny - starts[-1] < PAD:
+        # Fold a sliver at the bottom into the previous block
+        starts.pop()
+    stops = starts[1:] + [ny]
+
+    log.info(f'Demosaicing {nx}x{ny} frame ({method}) in {len(starts)} blocks')
+    rgb = np.empty((3, ny, nx), dtype=np.float32)
+
+    def run(bounds):
+        r0, r1 = bounds
+        rgb[:, r0:r1, :] = _demosaic_block(raw, r0, r1, phase, method)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run, zip(starts, stops)))
+    return rgb
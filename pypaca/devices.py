@@ -2,19 +2,18 @@
 import random
 import time
 
-import requests
 import json
 
-import numpy as np
-
 from . import log, AlpacaError
+from .transport import TransportPolicy
 
 ##-------------------------------------------------------------------------
 ## Abstract Alpaca Device
 ##-------------------------------------------------------------------------
 class Device(object):
     def __init__(self, IP, port=11111, device=None, device_number=0,
-                 ClientID=None, ClientTransactionID=0):
+                 ClientID=None, ClientTransactionID=0, transport=None,
+                 describe=True):
         alpaca_devices = ['switch', 'safetymonitor', 'dome', 'camera',
                           'observingconditions', 'filterwheel', 'focuser',
                           'rotator', 'telescope']
@@ -30,6 +29,21 @@ class Device(object):
         self.port = port
         self.device_number = device_number
         self.url = f"http://{IP}:{port}/api/v1/{self.device}/{self.device_number}/"
+        # transport may be a TransportPolicy or a dict of its options (as
+        # read from the Observatory config file)
+        if transport is None:
+            self.transport = TransportPolicy()
+        elif type(transport) == dict:
+            self.transport = TransportPolicy(**transport)
+        else:
+            self.transport = transport
+        self.changes = {}
+        # Write-through cache of the last value PUT for each setting
+        self.settings = {}
+        self.put_stats = {'issued': 0, 'skipped': 0}
+        if describe is False:
+            # Quick connection for one off queries (e.g. the command line)
+            return
         self.name = self.get_name()
         self.description = self.get_description()
         self.driverinfo = self.get_driverinfo()
@@ -37,12 +51,26 @@ class Device(object):
         self.supportedactions = self.get_supportedactions()
 
 
-    def get(self, command, quiet=False):
+    def get(self, command, quiet=False, deadline=None, read_timeout=None,
+            hedge=True, params=None):
         log.debug(f'GET {command}')
         payload = {'ClientID': self.clientID,
                    'ClientTransactionID': self.transactionID,
                    }
-        r = requests.get(self.url + command, data=payload)
+        if params is not None:
+            payload.update(params)
+        try:
+            r = self.transport.get(self.url + command, payload,
+                                   deadline=deadline,
+                                   read_timeout=read_timeout, hedge=hedge)
+        except AlpacaError as e:
+            log.error(f'GET {command} failed: {e}')
+            # The device may have been restarted, so settings are unknown
+            self.invalidate_settings()
+            return {'Value': None,
+                    'ErrorNumber': -1,
+                    'ErrorMessage': str(e),
+                   }
         if r.status_code == 200:
             try:
                 j = json.loads(r.text)
@@ -91,7 +119,7 @@ class Device(object):
             return {'Value': None}
 
 
-    def put(self, command, contents):
+    def put(self, command, contents, deadline=None, read_timeout=None):
         s = ', '.join([f'{key} = {contents[key]}' for key in contents.keys()])
         log.info(f'PUT {command}: {s}')
 
@@ -99,8 +127,23 @@ class Device(object):
                    'ClientTransactionID': self.transactionID,
                    }
         payload = {**default, **contents}
-        r = requests.put(self.url + command, data=payload)
-        j = json.loads(r.text)
+        # Count PUTs per command so cached readings of settings (such as
+        # the Observatory FITS header) know when they are stale
+        self.changes[command] = self.changes.get(command, 0) + 1
+        self.put_stats['issued'] += 1
+        if command == 'connected':
+            self.invalidate_settings()
+        r = self.transport.put(self.url + command, payload, deadline=deadline,
+                               read_timeout=read_timeout)
+        if r.status_code != 200:
+            log.error(f'PUT {command}: {s} failed')
+            log.error(f'  {r.status_code}: {r.text}')
+            raise AlpacaError(f'{r.status_code}: {r.text}')
+        try:
+            j = json.loads(r.text)
+        except json.JSONDecodeError as e:
+            log.error(f'PUT {command}: {s} failed: {e.msg}')
+            raise AlpacaError(e.msg)
 
         log.debug(f'  ClientTransactionID: {j["ClientTransactionID"]}')
         log.debug(f'  ServerTransactionID: {j["ServerTransactionID"]}')
@@ -122,6 +165,42 @@ class Device(object):
         return j
 
 
+    def put_setting(self, command, contents):
+        """PUT a setting unless it was already set to the same value.
+
+        Only use this for commands which set a value that stays put until we
+        change it (binning, gain, filter, ...), not for actions.  The cache is
+        cleared if a PUT fails or the device connection is lost.
+        """
+        if self.settings.get(command, None) == contents:
+            log.debug(f'PUT {command} skipped, already set')
+            self.put_stats['skipped'] += 1
+            return None
+        self.settings.pop(command, None)
+        try:
+            j = self.put(command, contents)
+        except AlpacaError:
+            self.invalidate_settings()
+            raise
+        self.settings[command] = dict(contents)
+        return j
+
+
+    def invalidate_settings(self, *commands):
+        """Forget cached settings (all of them if no commands are given) so
+        the next put_setting is sent to the device.
+        """
+        if len(commands) == 0:
+            self.settings = {}
+        for command in commands:
+            self.settings.pop(command, None)
+
+
+    def transport_stats(self):
+        """Latency percentiles and retry counts for this device's requests"""
+        return self.transport.stats()
+
+
     def get_connected(self):
         j = self.get('connected')
         return j['Value']
@@ -155,6 +234,29 @@ class Device(object):
 ##-------------------------------------------------------------------------
 ## Camera Device
 ##-------------------------------------------------------------------------
+# Image downloads are large and slow to serialize on the driver side, so they
+# get their own deadline (seconds) and are never hedged.
+IMAGE_DEADLINE = 300
+
+# Alpaca ImageArrayElementType for floating point pixels
+ELEMENT_DOUBLE = 3
+
+def image_dtype(maxadu, element_type=None):
+    """Smallest dtype which holds pixel values from 0 to maxadu.
+
+    Unsigned integers are used for integer frames, astropy writes them with
+    the standard BZERO offset (e.g. BITPIX 16 and BZERO 32768 for uint16).
+    """
+    import numpy as np
+    if element_type == ELEMENT_DOUBLE:
+        return np.float64
+    if maxadu is None:
+        return np.int32
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if maxadu <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
 class Camera(Device):
     def __init__(self, IP, **args):
         Device.__init__(self, IP, **args, device='camera')
@@ -183,6 +285,7 @@ class Camera(Device):
         self.readoutmodes = self.get('readoutmodes')['Value']
         self.sensorname = self.get('sensorname')['Value']
         self.sensortype = self.get('sensortype')['Value']
+        self.aborted = False
 
     def binning(self):
         binx = self.get('binx')['Value']
@@ -190,8 +293,8 @@ class Camera(Device):
         return (binx, biny)
 
     def set_binning(self, binx, biny):
-        self.put('binx', {'BinX': binx})
-        self.put('biny', {'BinY': biny})
+        self.put_setting('binx', {'BinX': binx})
+        self.put_setting('biny', {'BinY': biny})
 
     def camerastate(self):
         return self.get('camerastate')['Value']
@@ -208,7 +311,7 @@ class Camera(Device):
         return self.get('cooleron')['Value']
 
     def set_cooleron(self, on=True):
-        self.put('cooleron', {'CoolerOn': on})
+        self.put_setting('cooleron', {'CoolerOn': on})
 
     def coolerpower(self):
         if self.cangetcoolerpower is True:
@@ -221,28 +324,38 @@ class Camera(Device):
         return self.get('fastreadout')['Value']
 
     def set_fastreadout(self, fast=True):
-        self.put('fastreadout', {'FastReadout': fast})
+        self.put_setting('fastreadout', {'FastReadout': fast})
 
     def gain(self):
         return self.get('gain')['Value']
 
     def set_gain(self, gain):
-        self.put('gain', {'Gain': gain})
+        self.put_setting('gain', {'Gain': gain})
 
     def heatsinktemperature(self):
         return self.get('heatsinktemperature')['Value']
 
-    def imagearray(self):
+    def _imagedata(self, command):
+        # numpy is only needed for images, keep it out of the import
+        import numpy as np
         log.info('Getting image data')
-        data = np.array(self.get('imagearray', quiet=True)['Value'])
-        log.info(f'Got data of shape {data.shape}')
+        j = self.get(command, quiet=True, deadline=IMAGE_DEADLINE,
+                     read_timeout=IMAGE_DEADLINE, hedge=False)
+        dtype = image_dtype(self.maxadu, j.get('Type', None))
+        try:
+            data = np.array(j['Value'], dtype=dtype)
+        except (OverflowError, ValueError, TypeError):
+            log.warning(f'Image values do not fit in {np.dtype(dtype).name} '
+                        f'(maxadu = {self.maxadu})')
+            data = np.array(j['Value'])
+        log.info(f'Got data of shape {data.shape} ({data.dtype.name})')
         return data
 
+    def imagearray(self):
+        return self._imagedata('imagearray')
+
     def imagearrayvariant(self):
-        log.info('Getting image data')
-        data = np.array(self.get('imagearrayvariant', quiet=True)['Value'])
-        log.info(f'Got data of shape {data.shape}')
-        return data
+        return self._imagedata('imagearrayvariant')
 
     def imageready(self):
         return self.get('imageready', quiet=True)['Value']
@@ -254,6 +367,8 @@ class Camera(Device):
             while ready is False:
                 time.sleep(sleep)
 #                 self.percentcompleted()
+                if self.aborted is True:
+                    raise AlpacaError('Exposure aborted')
                 ready = self.imageready()
         if ready is True:
             log.info('Image ready for download')
@@ -265,6 +380,8 @@ class Camera(Device):
             while ready is False:
                 time.sleep(sleep)
 #                 self.percentcompleted()
+                if self.aborted is True:
+                    raise AlpacaError('Exposure aborted')
                 ready = self.imageready()
         if ready is True:
             log.info('Image ready for download')
@@ -286,10 +403,10 @@ class Camera(Device):
         return self.get('numy')['Value']
 
     def set_numx(self, numx):
-        self.put('numx', {'NumX': numx})
+        self.put_setting('numx', {'NumX': numx})
 
     def set_numy(self, numy):
-        self.put('numy', {'NumY': numy})
+        self.put_setting('numy', {'NumY': numy})
 
     def percentcompleted(self):
         return self.get('percentcompleted')['Value']
@@ -298,13 +415,13 @@ class Camera(Device):
         return self.get('readoutmode')['Value']
 
     def set_readoutmode(self, readoutmode):
-        self.put('readoutmode', {'ReadoutMode': readoutmode})
+        self.put_setting('readoutmode', {'ReadoutMode': readoutmode})
 
     def ccdsetpoint(self):
         return self.get('setccdtemperature')['Value']
 
     def set_ccdtemperature(self, setccdtemperature):
-        self.put('setccdtemperature', {'SetCCDTemperature': setccdtemperature})
+        self.put_setting('setccdtemperature', {'SetCCDTemperature': setccdtemperature})
 
     def startx(self):
         return self.get('startx')['Value']
@@ -313,12 +430,14 @@ class Camera(Device):
         return self.get('starty')['Value']
 
     def set_startx(self, startx):
-        self.put('startx', {'StartX': startx})
+        self.put_setting('startx', {'StartX': startx})
 
     def set_starty(self, starty):
-        self.put('starty', {'StartY': starty})
+        self.put_setting('starty', {'StartY': starty})
 
     def abortexposure(self):
+        # Let anything waiting on the image know it is not coming
+        self.aborted = True
         self.put('abortexposure', {})
 
     def pulseguide(self, direction, duration):
@@ -333,6 +452,7 @@ class Camera(Device):
         self.put('pulseguide', {'Direction': direction, 'Duration': duration})
 
     def startexposure(self, exptime, light=True):
+        self.aborted = False
         return self.put('startexposure', {'Duration': exptime, 'Light': light})
 
     def stopexposure(self):
@@ -361,7 +481,7 @@ class Focuser(Device):
         return self.get('tempcomp')['Value']
 
     def set_tempcomp(self, tempcomp):
-        self.put('tempcomp', {'TempComp': tempcomp})
+        self.put_setting('tempcomp', {'TempComp': tempcomp})
 
     def temperature(self):
         return self.get('temperature')['Value']
@@ -392,15 +512,19 @@ class FilterWheel(Device):
 
     def set_position(self, position):
         if type(position) == int:
-            self.put('position', {'Position': position})
+            self.put_setting('position', {'Position': position})
         elif position in self.names:
             posint = self.names.index(position)
-            self.put('position', {'Position': posint})
+            self.put_setting('position', {'Position': posint})
 
 
 ##-------------------------------------------------------------------------
 ## Telescope Device
 ##-------------------------------------------------------------------------
+# Synchronous slews, park and find home only answer once the mount has
+# stopped, so their PUTs get a long deadline and read timeout (seconds).
+SLEW_DEADLINE = 600
+
 class Telescope(Device):
     def __init__(self, IP, **args):
         Device.__init__(self, IP, **args, device='telescope')
@@ -447,25 +571,25 @@ class Telescope(Device):
         return self.get('declinationrate')['Value']
 
     def set_declinationrate(self, declinationrate):
-        self.put('declinationrate', {'DeclinationRate': declinationrate})
+        self.put_setting('declinationrate', {'DeclinationRate': declinationrate})
 
     def doesrefraction(self):
         return self.get('doesrefraction')['Value']
 
     def set_doesrefraction(self, doesrefraction):
-        self.put('doesrefraction', {'DoesRefraction': doesrefraction})
+        self.put_setting('doesrefraction', {'DoesRefraction': doesrefraction})
 
     def guideratedeclination(self):
         return self.get('guideratedeclination')['Value']
 
     def set_guideratedeclination(self, guideratedeclination):
-        self.put('guideratedeclination', {'GuideRateDeclination': guideratedeclination})
+        self.put_setting('guideratedeclination', {'GuideRateDeclination': guideratedeclination})
 
     def guideraterightascension(self):
         return self.get('guideraterightascension')['Value']
 
     def set_guideraterightascension(self, guideraterightascension):
-        self.put('guideraterightascension', {'GuideRateRightAscension': guideraterightascension})
+        self.put_setting('guideraterightascension', {'GuideRateRightAscension': guideraterightascension})
 
     def ispulseguiding(self):
         return self.get('ispulseguiding')['Value']
@@ -477,7 +601,7 @@ class Telescope(Device):
         return self.get('rightascensionrate')['Value']
 
     def set_rightascensionrate(self, rightascensionrate):
-        self.put('rightascensionrate', {'RightAscensionRate': rightascensionrate})
+        self.put_setting('rightascensionrate', {'RightAscensionRate': rightascensionrate})
 
     def sideofpier(self):
         return self.get('sideofpier')['Value']
@@ -492,19 +616,19 @@ class Telescope(Device):
         return self.get('siteelevation')['Value']
 
     def set_siteelevation(self, siteelevation):
-        self.put('siteelevation', {'SiteElevation': siteelevation})
+        self.put_setting('siteelevation', {'SiteElevation': siteelevation})
 
     def sitelatitude(self):
         return self.get('sitelatitude')['Value']
 
     def set_sitelatitude(self, sitelatitude):
-        self.put('sitelatitude', {'SiteLatitude': sitelatitude})
+        self.put_setting('sitelatitude', {'SiteLatitude': sitelatitude})
 
     def sitelongitude(self):
         return self.get('sitelongitude')['Value']
 
     def set_sitelongitude(self, sitelongitude):
-        self.put('sitelongitude', {'SiteLongitude': sitelongitude})
+        self.put_setting('sitelongitude', {'SiteLongitude': sitelongitude})
 
     def slewing(self):
         return self.get('slewing')['Value']
@@ -513,31 +637,31 @@ class Telescope(Device):
         return self.get('slewsettletime')['Value']
 
     def set_slewsettletime(self, slewsettletime):
-        self.put('slewsettletime', {'SlewSettleTime': slewsettletime})
+        self.put_setting('slewsettletime', {'SlewSettleTime': slewsettletime})
 
     def targetdeclination(self):
         return self.get('targetdeclination')['Value']
 
     def set_targetdeclination(self, targetdeclination):
-        self.put('targetdeclination', {'TargetDeclination': targetdeclination})
+        self.put_setting('targetdeclination', {'TargetDeclination': targetdeclination})
 
     def targetrightascension(self):
         return self.get('targetrightascension')['Value']
 
     def set_targetrightascension(self, targetrightascension):
-        self.put('targetrightascension', {'TargetRightAscension': targetrightascension})
+        self.put_setting('targetrightascension', {'TargetRightAscension': targetrightascension})
 
     def tracking(self):
         return self.get('tracking')['Value']
 
     def set_tracking(self, tracking):
-        self.put('tracking', {'Tracking': tracking})
+        self.put_setting('tracking', {'Tracking': tracking})
 
     def trackingrate(self):
         return self.get('trackingrate')['Value']
 
     def set_trackingrate(self, trackingrate):
-        self.put('trackingrate', {'TrackingRate': trackingrate})
+        self.put_setting('trackingrate', {'TrackingRate': trackingrate})
 
     def utcdate(self):
         return self.get('utcdate')['Value']
@@ -552,13 +676,17 @@ class Telescope(Device):
         return self.get('destinationsideofpier')['Value']
 
     def findhome(self):
-        self.put('findhome', {})
+        self.invalidate_settings('tracking')
+        self.put('findhome', {}, deadline=SLEW_DEADLINE,
+                 read_timeout=SLEW_DEADLINE)
 
     def moveaxis(self, moveaxis):
         self.put('moveaxis', {'MoveAxis': moveaxis})
 
     def park(self):
-        self.put('park', {})
+        self.invalidate_settings('tracking')
+        self.put('park', {}, deadline=SLEW_DEADLINE,
+                 read_timeout=SLEW_DEADLINE)
 
     def pulseguide(self, direction, duration):
         self.put('pulseguide', {'Direction': direction, 'Duration': duration})
@@ -567,19 +695,26 @@ class Telescope(Device):
         self.put('setpark', {})
 
     def slewtoaltaz(self, alt, az):
-        self.put('slewtoaltaz', {'Azimuth': az, 'Altitude': alt})
+        self.put('slewtoaltaz', {'Azimuth': az, 'Altitude': alt},
+                 deadline=SLEW_DEADLINE, read_timeout=SLEW_DEADLINE)
 
     def slewtoaltazasync(self, alt, az):
         self.put('slewtoaltazasync', {'Azimuth': az, 'Altitude': alt})
 
     def slewtocoordinates(self, RA, dec):
-        self.put('slewtocoordinates', {'RightAscension': RA, 'Declination': dec})
+        # The driver sets the target coordinates as well
+        self.invalidate_settings('targetrightascension', 'targetdeclination')
+        self.put('slewtocoordinates', {'RightAscension': RA, 'Declination': dec},
+                 deadline=SLEW_DEADLINE, read_timeout=SLEW_DEADLINE)
 
     def slewtocoordinatesasync(self, RA, dec):
+        # The driver sets the target coordinates as well
+        self.invalidate_settings('targetrightascension', 'targetdeclination')
         self.put('slewtocoordinatesasync', {'RightAscension': RA, 'Declination': dec})
 
     def slewtotarget(self):
-        self.put('slewtotarget', {})
+        self.put('slewtotarget', {}, deadline=SLEW_DEADLINE,
+                 read_timeout=SLEW_DEADLINE)
 
     def slewtotargetasync(self):
         self.put('slewtotargetasync', {})
@@ -588,6 +723,8 @@ class Telescope(Device):
         self.put('synctoaltaz', {'Azimuth': az, 'Altitude': alt})
 
     def synctocoordinates(self, RA, dec):
+        # The driver sets the target coordinates as well
+        self.invalidate_settings('targetrightascension', 'targetdeclination')
         self.put('synctocoordinates', {'RightAscension': RA, 'Declination': dec})
 
     def synctotarget(self):
@@ -597,6 +734,230 @@ class Telescope(Device):
         self.put('unpark', {})
 
 
+##-------------------------------------------------------------------------
+## Dome Device
+##-------------------------------------------------------------------------
+class Dome(Device):
+    def __init__(self, IP, **args):
+        Device.__init__(self, IP, **args, device='dome')
+        self.canfindhome = self.get('canfindhome')['Value']
+        self.canpark = self.get('canpark')['Value']
+        self.cansetaltitude = self.get('cansetaltitude')['Value']
+        self.cansetazimuth = self.get('cansetazimuth')['Value']
+        self.cansetpark = self.get('cansetpark')['Value']
+        self.cansetshutter = self.get('cansetshutter')['Value']
+        self.canslave = self.get('canslave')['Value']
+        self.cansyncazimuth = self.get('cansyncazimuth')['Value']
+
+    def altitude(self):
+        return self.get('altitude')['Value']
+
+    def athome(self):
+        return self.get('athome')['Value']
+
+    def atpark(self):
+        return self.get('atpark')['Value']
+
+    def azimuth(self):
+        return self.get('azimuth')['Value']
+
+    def shutterstatus(self):
+        # 0 = Open, 1 = Closed, 2 = Opening, 3 = Closing, 4 = Error
+        return self.get('shutterstatus')['Value']
+
+    def slaved(self):
+        return self.get('slaved')['Value']
+
+    def set_slaved(self, slaved):
+        self.put_setting('slaved', {'Slaved': slaved})
+
+    def slewing(self):
+        return self.get('slewing')['Value']
+
+    def abortslew(self):
+        self.put('abortslew', {})
+
+    def closeshutter(self):
+        self.put('closeshutter', {})
+
+    def findhome(self):
+        self.put('findhome', {})
+
+    def openshutter(self):
+        self.put('openshutter', {})
+
+    def park(self):
+        self.invalidate_settings('slaved')
+        self.put('park', {})
+
+    def setpark(self):
+        self.put('setpark', {})
+
+    def slewtoaltitude(self, alt):
+        self.put('slewtoaltitude', {'Altitude': alt})
+
+    def slewtoazimuth(self, az):
+        self.put('slewtoazimuth', {'Azimuth': az})
+
+    def synctoazimuth(self, az):
+        self.put('synctoazimuth', {'Azimuth': az})
+
+
+##-------------------------------------------------------------------------
+## Safety Monitor Device
+##-------------------------------------------------------------------------
+class SafetyMonitor(Device):
+    def __init__(self, IP, **args):
+        Device.__init__(self, IP, **args, device='safetymonitor')
+
+    def issafe(self, deadline=None):
+        return self.get('issafe', quiet=True, deadline=deadline)['Value']
+
+
+##-------------------------------------------------------------------------
+## Observing Conditions Device
+##-------------------------------------------------------------------------
+class ObservingConditions(Device):
+    def __init__(self, IP, **args):
+        Device.__init__(self, IP, **args, device='observingconditions')
+
+    def averageperiod(self):
+        return self.get('averageperiod')['Value']
+
+    def set_averageperiod(self, averageperiod):
+        self.put_setting('averageperiod', {'AveragePeriod': averageperiod})
+
+    def cloudcover(self):
+        return self.get('cloudcover')['Value']
+
+    def dewpoint(self):
+        return self.get('dewpoint')['Value']
+
+    def humidity(self):
+        return self.get('humidity')['Value']
+
+    def pressure(self):
+        return self.get('pressure')['Value']
+
+    def rainrate(self):
+        return self.get('rainrate')['Value']
+
+    def skybrightness(self):
+        return self.get('skybrightness')['Value']
+
+    def skyquality(self):
+        return self.get('skyquality')['Value']
+
+    def skytemperature(self):
+        return self.get('skytemperature')['Value']
+
+    def starfwhm(self):
+        return self.get('starfwhm')['Value']
+
+    def temperature(self):
+        return self.get('temperature')['Value']
+
+    def winddirection(self):
+        return self.get('winddirection')['Value']
+
+    def windgust(self):
+        return self.get('windgust')['Value']
+
+    def windspeed(self):
+        return self.get('windspeed')['Value']
+
+    def refresh(self):
+        self.put('refresh', {})
+
+    def sensordescription(self, sensor):
+        return self.get('sensordescription',
+                        params={'SensorName': sensor})['Value']
+
+    def timesincelastupdate(self, sensor=''):
+        return self.get('timesincelastupdate',
+                        params={'SensorName': sensor})['Value']
+
+
+##-------------------------------------------------------------------------
+## Rotator Device
+##-------------------------------------------------------------------------
+class Rotator(Device):
+    def __init__(self, IP, **args):
+        Device.__init__(self, IP, **args, device='rotator')
+        self.canreverse = self.get('canreverse')['Value']
+        self.stepsize = self.get('stepsize')['Value']
+
+    def ismoving(self):
+        return self.get('ismoving')['Value']
+
+    def position(self):
+        return self.get('position')['Value']
+
+    def reverse(self):
+        return self.get('reverse')['Value']
+
+    def set_reverse(self, reverse):
+        self.put_setting('reverse', {'Reverse': reverse})
+
+    def targetposition(self):
+        return self.get('targetposition')['Value']
+
+    def halt(self):
+        self.put('halt', {})
+
+    def move(self, position):
+        # Relative move (degrees)
+        self.put('move', {'Position': position})
+
+    def moveabsolute(self, position):
+        self.put('moveabsolute', {'Position': position})
+
+
+##-------------------------------------------------------------------------
+## Switch Device
+##-------------------------------------------------------------------------
+class Switch(Device):
+    def __init__(self, IP, **args):
+        Device.__init__(self, IP, **args, device='switch')
+        self.maxswitch = self.get('maxswitch')['Value']
+        self.names = [self.getswitchname(i) for i in range(self.maxswitch or 0)]
+
+    def canwrite(self, id):
+        return self.get('canwrite', params={'Id': id})['Value']
+
+    def getswitch(self, id):
+        return self.get('getswitch', params={'Id': id})['Value']
+
+    def getswitchdescription(self, id):
+        return self.get('getswitchdescription', params={'Id': id})['Value']
+
+    def getswitchname(self, id):
+        return self.get('getswitchname', params={'Id': id})['Value']
+
+    def getswitchvalue(self, id):
+        return self.get('getswitchvalue', params={'Id': id})['Value']
+
+    def minswitchvalue(self, id):
+        return self.get('minswitchvalue', params={'Id': id})['Value']
+
+    def maxswitchvalue(self, id):
+        return self.get('maxswitchvalue', params={'Id': id})['Value']
+
+    def switchstep(self, id):
+        return self.get('switchstep', params={'Id': id})['Value']
+
+    def setswitch(self, id, state):
+        self.put('setswitch', {'Id': id, 'State': state})
+
+    def setswitchname(self, id, name):
+        self.put('setswitchname', {'Id': id, 'Name': name})
+        self.names[id] = name
+
+    def setswitchvalue(self, id, value):
+        self.put('setswitchvalue', {'Id': id, 'Value': value})
+
+
+
 
 
 
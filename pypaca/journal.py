@@ -0,0 +1,142 @@
+#!/usr/env/python
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import hashlib
+import json
+import os
+
+from . import log
+
+##-------------------------------------------------------------------------
+## Sequence Journal
+##-------------------------------------------------------------------------
+def file_checksum(file, blocksize=1<<20):
+    """SHA-256 of a file's contents."""
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def fsync_file(path):
+    """Flush a file, and the directory entry pointing at it, to disk."""
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+    if os.name != 'nt':
+        # Windows can not open a directory to fsync it
+        fd = os.open(Path(path).parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def sequence_id(sequence):
+    """Fingerprint of a Sequence's target and table, so a journal is only
+    used to resume the sequence which wrote it.
+    """
+    h = hashlib.sha256(str(getattr(sequence, 'targname', '')).encode())
+    for row in sequence.table:
+        h.update(('\n' + ' '.join([str(v) for v in row])).encode())
+    return h.hexdigest()[:16]
+
+
+class SequenceJournal(object):
+    """Append only, fsync'd record of the frames written by a sequence run.
+
+    Each line is a JSON object with the row and frame numbers, absolute file
+    path, size and SHA-256 of one successfully written frame.  The frame file
+    (and its directory) are fsync'd before its line is appended, so the
+    journal never vouches for data which is not on disk.  Checksumming and
+    the fsyncs happen on a background thread, so recording a frame does not
+    hold up the next exposure.  A torn last line (from a crash during a
+    write) is ignored when the journal is read back.
+    """
+    def __init__(self, file, sequence, resume=True):
+        self.file = Path(file).expanduser()
+        self.sequence = sequence
+        self.done = {}    # (row, frame) -> entry
+        if resume is True:
+            self.read()
+        self._f = None
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+
+    def read(self):
+        if not self.file.exists():
+            return
+        with open(self.file, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get('sequence', None) != self.sequence:
+                    continue
+                self.done[(entry['row'], entry['frame'])] = entry
+        log.info(f'Journal {self.file} has {len(self.done)} frames done')
+
+    def is_done(self, row, frame, verify=False):
+        """True if the frame was recorded and its file is still intact
+        (same size, and same checksum if verify is True).
+        """
+        entry = self.done.get((row, frame), None)
+        if entry is None:
+            return False
+        path = Path(entry['file'])
+        if not path.exists() or path.stat().st_size != entry['size']:
+            return False
+        if verify is True and file_checksum(path) != entry['sha256']:
+            return False
+        return True
+
+    def _open(self):
+        if self._f is None:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            torn = False
+            if self.file.exists() and self.file.stat().st_size > 0:
+                with open(self.file, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b'\n'
+            self._f = open(self.file, 'a')
+            if torn is True:
+                # Start a fresh line after a partial write
+                self._f.write('\n')
+        return self._f
+
+    def _record(self, row, frame, file):
+        path = Path(file).resolve()
+        fsync_file(path)
+        entry = {'sequence': self.sequence,
+                 'row': row,
+                 'frame': frame,
+                 'file': str(path),
+                 'size': path.stat().st_size,
+                 'sha256': file_checksum(path),
+                 'time': datetime.datetime.utcnow().isoformat(),
+                }
+        f = self._open()
+        f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+        self.done[(row, frame)] = entry
+
+    def record(self, row, frame, file):
+        """Record a successfully written frame."""
+        self._pending.append(self._pool.submit(self._record, row, frame,
+                                               file))
+
+    def close(self):
+        """Wait for pending records to reach the disk."""
+        for pending in self._pending:
+            try:
+                pending.result()
+            except OSError as e:
+                log.error(f'Failed to record frame in journal: {e}')
+        self._pending = []
+        self._pool.shutdown()
+        if self._f is not None:
+            self._f.close()
+            self._f = None
@@ -4,13 +4,18 @@
 from pathlib import Path
 import yaml
 import datetime
-from time import sleep
+from time import sleep, monotonic
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from astropy.io import fits
 from astropy.table import Table
 
 from . import log, devices, AlpacaError, ObservatoryError
+from .demosaic import demosaic, bayer_phase, SENSORTYPE_RGGB
+from .journal import SequenceJournal, sequence_id
+from .services import altaz, DomeSlaver, SafetyWatcher
 
 
 ##-------------------------------------------------------------------------
@@ -41,6 +46,98 @@ class Sequence(object):
 
 
 
+##-------------------------------------------------------------------------
+## FITS Header Cards
+##-------------------------------------------------------------------------
+# Each card is (keyword, device, source, comment, depends).  source is the
+# name of a device attribute or method, a (method, index) pair for one item of
+# a method's result or (method, function) for a function of it (the method is
+# only called once per collection), or a function of the device.  depends is
+# None for values read on every frame, otherwise the PUT commands which change
+# the value ( () means it only changes on reconnect).
+STATIC = ()
+PRE_CARDS = [
+    ('ALT0', 'Telescope', 'altitude', 'Telescope altitude (deg) at start of exposure', None),
+    ('AZ0', 'Telescope', 'azimuth', 'Telescope azimuth (deg) at start of exposure', None),
+    ('DEC0', 'Telescope', 'declination', 'Telescope DEC (deg) at start of exposure', None),
+    ('DECRATE0', 'Telescope', 'declinationrate', 'Telescope DEC rate (unit?) at start of exposure', ('declinationrate',)),
+    ('RA0', 'Telescope', 'rightascension', 'Telescope RA (hours) at start of exposure', None),
+    ('RARATE0', 'Telescope', 'rightascensionrate', 'Telescope RA rate (unit?) at start of exposure', ('rightascensionrate',)),
+    ('LST0', 'Telescope', 'siderealtime', 'Sidereal time (hours) at start of exposure', None),
+    ('TARGDEC0', 'Telescope', 'targetdeclination', 'Target DEC (deg) at start of exposure', None),
+    ('TARGRA0', 'Telescope', 'targetrightascension', 'Target RA (hours) at start of exposure', None),
+    ('TELUT0', 'Telescope', 'utcdate', 'Telescope UT at start of exposure', None),
+]
+POST_CARDS = [
+    # Telescope
+    ('TELNAME', 'Telescope', 'name', 'Telescope name from driver', STATIC),
+    ('TELINFO', 'Telescope', 'description', '', STATIC),
+    ('TELDRIVR', 'Telescope', 'driverversion', 'Telescope driver version', STATIC),
+    ('ALT', 'Telescope', 'altitude', 'Telescope altitude (deg) at end of exposure', None),
+    ('AZ', 'Telescope', 'azimuth', 'Telescope azimuth (deg) at end of exposure', None),
+    ('DEC', 'Telescope', 'declination', 'Telescope DEC (deg) at end of exposure', None),
+    ('DECRATE', 'Telescope', 'declinationrate', 'Telescope DEC rate (unit?) at end of exposure', ('declinationrate',)),
+    ('RA', 'Telescope', 'rightascension', 'Telescope RA (hours) at end of exposure', None),
+    ('RARATE', 'Telescope', 'rightascensionrate', 'Telescope RA rate (unit?) at end of exposure', ('rightascensionrate',)),
+    ('PIERSIDE', 'Telescope', 'sideofpier', 'Pier side reported by telescope', None),
+    ('LST', 'Telescope', 'siderealtime', 'Sidereal time (hours) at end of exposure', None),
+    ('SITE_EL', 'Telescope', 'siteelevation', 'Site elevation (unit?)', ('siteelevation',)),
+    ('SITE_LAT', 'Telescope', 'sitelatitude', 'Site latitude', ('sitelatitude',)),
+    ('SITE_LON', 'Telescope', 'sitelongitude', 'Site longitude', ('sitelongitude',)),
+    ('TARGDEC', 'Telescope', 'targetdeclination', 'Target DEC (deg) at end of exposure', None),
+    ('TARGRA', 'Telescope', 'targetrightascension', 'Target RA (hours) at end of exposure', None),
+    ('TRACKING', 'Telescope', 'tracking', 'Tracking status', None),
+    ('TRACRATE', 'Telescope', 'trackingrate', 'Tracking rate (units?)', ('trackingrate',)),
+    ('TELUT', 'Telescope', 'utcdate', 'Telescope UT at end of exposure', None),
+    # Camera1
+    ('CAMNAME', 'Camera1', 'name', 'Camera name from driver', STATIC),
+    ('CAMINFO', 'Camera1', 'description', '', STATIC),
+    ('CAMDRIVR', 'Camera1', 'driverversion', 'Camera driver version', STATIC),
+    ('BAYEROX', 'Camera1', 'bayeroffsetx', 'Bayer offset X', STATIC),
+    ('BAYEROY', 'Camera1', 'bayeroffsety', 'Bayer offset Y', STATIC),
+    ('PIXSIZEX', 'Camera1', 'pixelsizex', 'Pixel size (microns) in X direction', STATIC),
+    ('PIXSIZEY', 'Camera1', 'pixelsizey', 'Pixel size (microns) in Y direction', STATIC),
+    ('CCDNAME', 'Camera1', 'sensorname', 'Sensor name from driver', STATIC),
+    ('CCDTYPE', 'Camera1', 'sensortype', 'CCD type from driver', STATIC),
+    ('BINX', 'Camera1', ('binning', 0), 'X Binning', ('binx',)),
+    ('BINY', 'Camera1', ('binning', 1), 'Y Binning', ('biny',)),
+    ('BINNING', 'Camera1', ('binning', lambda b: '{}, {}'.format(*b)), 'Binning', ('binx', 'biny')),
+    ('DETSIZE', 'Camera1', lambda c: str(c.camerasize()), 'Size of detector in pixels', STATIC),
+    ('DETTEMP', 'Camera1', 'ccdtemperature', 'Detector temperature (degrees C)', None),
+    ('DETSETP', 'Camera1', 'ccdsetpoint', 'Detector set point (degrees C)', ('setccdtemperature',)),
+    ('COOLON', 'Camera1', 'cooleron', 'Detector cooler on?', ('cooleron',)),
+    ('COOLPWR', 'Camera1', 'coolerpower', 'Cooler power ouput (%)', None),
+    ('EPERADU', 'Camera1', 'electronsperadu', 'Gain in electrons per adu', ('gain', 'readoutmode')),
+    ('GAIN', 'Camera1', 'gain', 'Gain in camera units (db?)', ('gain',)),
+    ('EXPTIME', 'Camera1', 'lastexposureduration', 'Exposure duration (seconds)', None),
+    ('EXPSTART', 'Camera1', 'lastexposurestarttime', 'Start time of last exposure', None),
+    ('NUMX', 'Camera1', 'numx', 'Window size (pixels) in X', ('numx',)),
+    ('NUMY', 'Camera1', 'numy', 'Window size (pixels) in Y', ('numy',)),
+    ('STARTX', 'Camera1', 'startx', 'Starting X pixel of window', ('startx',)),
+    ('STARTY', 'Camera1', 'starty', 'Starting Y pixel of window', ('starty',)),
+    # Filter Wheel1
+    ('FWNAME', 'FilterWheel1', 'name', 'Filter wheel name from driver', STATIC),
+    ('FWINFO', 'FilterWheel1', 'description', '', STATIC),
+    ('FWDRIVR', 'FilterWheel1', 'driverversion', 'Filter wheel driver version', STATIC),
+    ('FILTER', 'FilterWheel1', ('position', 1), 'Filter name', None),
+    ('FILTPOS', 'FilterWheel1', ('position', 0), 'Filter position', None),
+    # Focuser1
+    ('FOCNAME', 'Focuser1', 'name', 'Focuser name from driver', STATIC),
+    ('FOCINFO', 'Focuser1', 'description', '', STATIC),
+    ('FOCDRIVR', 'Focuser1', 'driverversion', 'Focuser driver version', STATIC),
+    ('FOCUSPOS', 'Focuser1', 'position', 'Focuser position', None),
+    ('TEMPCOMP', 'Focuser1', 'tempcomp', 'Temperature compensation active?', ('tempcomp',)),
+    ('FOCTEMP', 'Focuser1', 'temperature', 'Focuser temperature (degrees C)', None),
+]
+
+
+def header_from_dict(cards):
+    """Build a Header in one go from {keyword: (value, comment)}, which is
+    much faster than repeated Header.set calls.
+    """
+    return fits.Header([(k, v, c) for k, (v, c) in cards.items()])
+
+
 ##-------------------------------------------------------------------------
 ## Observatory
 ##-------------------------------------------------------------------------
@@ -55,12 +152,25 @@ class Observatory(object):
         self.FilterWheel2 = None # filter wheel for guide camera
         self.Focuser2 = None     # focuser for guide camera
         self.Telescope = None   # telescope (aka mount)
+        self.Rotator1 = None     # rotator for main imaging camera
+        self.Dome = None
+        self.SafetyMonitor = None
+        self.ObservingConditions = None
+        self.Switch = None
 
         self.imtypes_light = ['light', 'twiflat', 'sky', 'domeflat']
         self.imtypes_dark = ['bias', 'dark']
         self.imtypes = self.imtypes_light.extend(self.imtypes_dark)
 
         self.targname = ''
+        self.header_cache = {}
+        self.focus_offsets = None   # filter name -> focuser offset (steps)
+        self.focus_history = {}     # filter name -> (time, best position)
+        self.safe = True
+        # Held from the last safety check to the startexposure PUT, so
+        # make_safe() can not slip in between them
+        self.safety_lock = threading.Lock()
+        self.services = []
 
         # Load configuration
         if configfile is not None:
@@ -93,10 +203,236 @@ class Observatory(object):
         """Connect to all devices"""
         for key in self.devices.keys():
             devtype = key[:-1] if key[-1] in ['1', '2'] else key
-            if devtype in ['Camera', 'FilterWheel', 'Focuser', 'Telescope']:
+            if devtype in ['Camera', 'FilterWheel', 'Focuser', 'Telescope',
+                           'Rotator', 'Dome', 'SafetyMonitor',
+                           'ObservingConditions', 'Switch']:
                 self.connect_to(key)
 
-    def collect_metadata(self, pre=False):
+    def start_services(self):
+        """Start the safety watcher (if there is a SafetyMonitor or
+        ObservingConditions device) and dome slaving (if the slave_dome option
+        is set).
+        """
+        if self.SafetyMonitor is not None or self.ObservingConditions is not None:
+            self.services.append(SafetyWatcher(self,
+                                 limits=self.options.get('safety_limits', None),
+                                 safe_delay=self.options.get('safe_delay', 300)))
+        if self.Dome is not None and self.options.get('slave_dome', False) is True:
+            self.services.append(DomeSlaver(self))
+        for service in self.services:
+            service.start()
+
+    def stop_services(self):
+        for service in self.services:
+            service.stop()
+        self.services = []
+
+    def make_safe(self, reasons=None):
+        """Abort any exposure, stop the telescope and close the dome, all at
+        the same time.  Light exposures are refused until self.safe is set
+        True again (by the SafetyWatcher once conditions recover).
+        """
+        with self.safety_lock:
+            self.safe = False
+        log.warning(f'Making observatory safe: {reasons}')
+
+        def camera(cam):
+            if cam.canabort is True:
+                cam.abortexposure()
+
+        def telescope(t):
+            if t.slewing() is True:
+                t.abortslew()
+            if t.canpark is True:
+                t.park()
+            elif t.cansettracking is True:
+                t.set_tracking(False)
+
+        def dome(d):
+            if d.cansetshutter is True:
+                d.closeshutter()
+            if d.canpark is True:
+                d.park()
+
+        actions = {'Camera1': camera, 'Camera2': camera,
+                   'Telescope': telescope, 'Dome': dome}
+        with ThreadPoolExecutor(max_workers=len(actions)) as pool:
+            results = [(name, pool.submit(action, getattr(self, name)))
+                       for name, action in actions.items()
+                       if getattr(self, name) is not None]
+            for name, result in results:
+                try:
+                    result.result()
+                except AlpacaError as e:
+                    log.error(f'Failed to make {name} safe: {e}')
+
+    def slew(self, RA, dec, wait=True, poll=1, timeout=300):
+        """Slew the telescope to RA (hours) and dec (degrees) and move the
+        dome to the target azimuth at the same time, rather than after the
+        telescope has arrived.  With wait True, wait up to timeout seconds
+        for both to stop.
+        """
+        if self.safe is False:
+            raise ObservatoryError('Observatory is not safe, will not slew')
+        t = self.Telescope
+        dome = self.Dome
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            moves = [pool.submit(t.slewtocoordinatesasync, RA, dec)]
+            if dome is not None:
+                alt, az = altaz(t.siderealtime() - RA, dec, t.sitelatitude())
+                log.info(f'Moving dome to {az:.1f}')
+                moves.append(pool.submit(dome.slewtoazimuth, az))
+            for move in moves:
+                move.result()
+        t_end = monotonic() + timeout
+        while wait is True:
+            moving = t.get('slewing', quiet=True)['Value'] is True\
+                     or (dome is not None
+                         and dome.get('slewing', quiet=True)['Value'] is True)
+            if not moving:
+                break
+            if monotonic() > t_end:
+                raise ObservatoryError(f'Slew did not finish in {timeout} s')
+            sleep(poll)
+
+    def load_focus_offsets(self):
+        """Per filter focus offsets from the filter wheel driver, updated with
+        any learned offsets saved in the focus_offsets_file option.
+        """
+        fw = self.FilterWheel1
+        offsets = {}
+        if fw.focusoffsets is not None and fw.names is not None:
+            offsets = dict(zip(fw.names, fw.focusoffsets))
+        file = self.options.get('focus_offsets_file', None)
+        if file is not None and Path(file).expanduser().exists():
+            with open(Path(file).expanduser(), 'r') as f:
+                saved = yaml.safe_load(f.read())
+            if saved is not None:
+                offsets.update(saved)
+        self.focus_offsets = offsets
+
+    def save_focus_offsets(self):
+        file = self.options.get('focus_offsets_file', None)
+        if file is None or self.focus_offsets is None:
+            return
+        with open(Path(file).expanduser(), 'w') as f:
+            f.write(yaml.safe_dump({k: float(v) for k, v
+                                    in self.focus_offsets.items()}))
+
+    def learn_focus_offset(self, filter, position, max_age=3600, weight=0.5):
+        """Record the best focus position found by autofocus in filter.
+
+        For every other filter which was autofocused within max_age seconds,
+        the difference in best position gives a measurement of this filter's
+        offset.  The mean of those measurements is blended into the current
+        offset with the given weight and the offsets are saved.
+        """
+        if self.focus_offsets is None:
+            self.load_focus_offsets()
+        now = monotonic()
+        self.focus_history[filter] = (now, position)
+        if len(self.focus_offsets) == 0:
+            # No offsets from the driver or a file: the first filter focused
+            # is the zero point the others are learned against
+            log.info(f'Focus offsets measured relative to {filter}')
+            self.focus_offsets[filter] = 0
+            self.save_focus_offsets()
+            return
+        estimates = []
+        for other, (t, other_position) in self.focus_history.items():
+            if other == filter or now - t > max_age\
+               or other not in self.focus_offsets:
+                continue
+            estimates.append(self.focus_offsets[other]
+                             + position - other_position)
+        if len(estimates) == 0:
+            return
+        measured = sum(estimates) / len(estimates)
+        old = self.focus_offsets.get(filter, None)
+        new = measured if old is None else (1 - weight)*old + weight*measured
+        log.info(f'Focus offset for {filter}: {old} -> {new:.1f}')
+        self.focus_offsets[filter] = new
+        self.save_focus_offsets()
+
+    def change_filter(self, filter, poll=0.5, timeout=120):
+        """Change filter on FilterWheel1 and move Focuser1 by the difference
+        in focus offsets at the same time, then wait (up to timeout seconds)
+        for both to finish.
+        """
+        fw = self.FilterWheel1
+        focuser = self.Focuser1
+        if type(filter) == int:
+            filter = fw.names[filter]
+        if self.focus_offsets is None:
+            self.load_focus_offsets()
+        pos, current = fw.position()
+        if current == filter:
+            return
+        delta = 0
+        if focuser is not None and current in self.focus_offsets\
+           and filter in self.focus_offsets:
+            delta = int(round(self.focus_offsets[filter]
+                              - self.focus_offsets[current]))
+        # The wheel is not where the setting cache may think (e.g. another
+        # client moved it), so make sure the PUT is sent
+        fw.invalidate_settings('position')
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            moves = [pool.submit(fw.set_position, filter)]
+            if delta != 0:
+                if focuser.absolute is True:
+                    target = focuser.position() + delta
+                else:
+                    target = delta
+                log.info(f'Moving focus by {delta} for {current} -> {filter}')
+                moves.append(pool.submit(focuser.move, target))
+            for move in moves:
+                move.result()
+        t_end = monotonic() + timeout
+        while True:
+            fw_moving = fw.get('position', quiet=True)['Value'] == -1
+            focus_moving = delta != 0\
+                           and focuser.get('ismoving', quiet=True)['Value'] is True
+            if not fw_moving and not focus_moving:
+                break
+            if monotonic() > t_end:
+                raise ObservatoryError(f'Filter change to {filter} did not '
+                                       f'finish in {timeout} s')
+            sleep(poll)
+
+    def invalidate_header(self):
+        """Forget cached header values, e.g. after another client has changed
+        device settings behind our back.
+        """
+        self.header_cache = {}
+
+    def _card_value(self, dev, source, depends, memo=None):
+        """Return the value for a header card, from the cache if nothing it
+        depends on has been PUT to the device since it was read.  memo holds
+        the results of (method, index) sources for one collection.
+        """
+        if depends is not None:
+            key = (id(dev), source)
+            counts = tuple([dev.changes.get(c, 0) for c in depends])
+            cached = self.header_cache.get(key)
+            if cached is not None and cached[1] is dev and cached[2] == counts:
+                return cached[0]
+        if type(source) == tuple:
+            method, index = source
+            if memo is None:
+                memo = {}
+            if (id(dev), method) not in memo:
+                memo[(id(dev), method)] = getattr(dev, method)()
+            result = memo[(id(dev), method)]
+            value = index(result) if callable(index) else result[index]
+        else:
+            value = source(dev) if callable(source) else getattr(dev, source)
+            if callable(value):
+                value = value()
+        if depends is not None:
+            self.header_cache[key] = (value, dev, counts)
+        return value
+
+    def collect_metadata(self, pre=False, unit=1, include=None):
         """Collect metadata from connected devices.
         
         Telescope: RA, DEC, alt, az, airmass, name, focal length, aperture
@@ -105,185 +441,267 @@ class Observatory(object):
         Focuser1: position, temperature
         Observatory: config, sequence info, frame ID, obstype
         Other: UT time, software version
+
+        Cards which only change when we set them are read once and cached
+        (see PRE_CARDS and POST_CARDS), so each frame only queries the truly
+        dynamic values.
+
+        unit selects which Camera, FilterWheel and Focuser (1 or 2) the
+        camera cards come from.  include limits the cards to those of the
+        listed devices as named in the card tables; the general cards (UT,
+        TARGNAME) come with 'Telescope'.
         """
-        h = fits.Header()
         now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')
+        general = include is None or 'Telescope' in include
         if pre is True:
             log.info('Collecting pre-exposure metadata')
-            # General
-            h.set('UT1', value=now,
-                  comment='Computer UT at start of exposure')
-            h.set('TARGNAME', value=self.targname,
-                  comment='Target name')
-            # Telescope
-            h.set('ALT0', value=self.Telescope.altitude(),
-                  comment='Telescope altitude (deg) at start of exposure')
-            h.set('AZ0', value=self.Telescope.azimuth(),
-                  comment='Telescope azimuth (deg) at start of exposure')
-            h.set('DEC0', value=self.Telescope.declination(),
-                  comment='Telescope DEC (deg) at start of exposure')
-            h.set('DECRATE0', value=self.Telescope.declinationrate(),
-                  comment='Telescope DEC rate (unit?) at start of exposure')
-            h.set('RA0', value=self.Telescope.rightascension(),
-                  comment='Telescope RA (hours) at start of exposure')
-            h.set('RARATE0', value=self.Telescope.rightascensionrate(),
-                  comment='Telescope RA rate (unit?) at start of exposure')
-            h.set('LST0', value=self.Telescope.siderealtime(),
-                  comment='Sidereal time (hours) at start of exposure')
-            h.set('TARGDEC0', value=self.Telescope.targetdeclination(),
-                  comment='Target DEC (deg) at start of exposure')
-            h.set('TARGRA0', value=self.Telescope.targetrightascension(),
-                  comment='Target RA (hours) at start of exposure')
-            h.set('TELUT0', value=self.Telescope.utcdate(),
-                  comment='Telescope UT at start of exposure')
-        if pre is False:
+            cards = {'UT1': (now, 'Computer UT at start of exposure'),
+                     'TARGNAME': (self.targname, 'Target name'),
+                    }
+            table = PRE_CARDS
+        else:
             log.info('Collecting post-exposure metadata')
-            # General
-            h.set('UT', value=now,
-                  comment='Computer UT at end of exposure')
-            # Telescope
-            h.set('TELNAME', value=self.Telescope.name,
-                  comment='Telescope name from driver')
-            h.set('TELINFO', value=self.Telescope.description)
-            h.set('TELDRIVR', value=self.Telescope.driverversion,
-                  comment='Telescope driver version')
-            h.set('ALT', value=self.Telescope.altitude(),
-                  comment='Telescope altitude (deg) at end of exposure')
-            h.set('AZ', value=self.Telescope.azimuth(),
-                  comment='Telescope azimuth (deg) at end of exposure')
-            h.set('DEC', value=self.Telescope.declination(),
-                  comment='Telescope DEC (deg) at end of exposure')
-            h.set('DECRATE', value=self.Telescope.declinationrate(),
-                  comment='Telescope DEC rate (unit?) at end of exposure')
-            h.set('RA', value=self.Telescope.rightascension(),
-                  comment='Telescope RA (hours) at end of exposure')
-            h.set('RARATE', value=self.Telescope.rightascensionrate(),
-                  comment='Telescope RA rate (unit?) at end of exposure')
-            h.set('PIERSIDE', value=self.Telescope.sideofpier(),
-                  comment='Pier side reported by telescope')
-            h.set('LST', value=self.Telescope.siderealtime(),
-                  comment='Sidereal time (hours) at end of exposure')
-            h.set('SITE_EL', value=self.Telescope.siteelevation(),
-                  comment='Site elevation (unit?)')
-            h.set('SITE_LAT', value=self.Telescope.sitelatitude(),
-                  comment='Site latitude')
-            h.set('SITE_LON', value=self.Telescope.sitelongitude(),
-                  comment='Site longitude')
-            h.set('TARGDEC', value=self.Telescope.targetdeclination(),
-                  comment='Target DEC (deg) at end of exposure')
-            h.set('TARGRA', value=self.Telescope.targetrightascension(),
-                  comment='Target RA (hours) at end of exposure')
-            h.set('TRACKING', value=self.Telescope.tracking(),
-                  comment='Tracking status')
-            h.set('TRACRATE', value=self.Telescope.trackingrate(),
-                  comment='Tracking rate (units?)')
-            h.set('TELUT', value=self.Telescope.utcdate(),
-                  comment='Telescope UT at end of exposure')
-            # Camera1
-            h.set('CAMNAME', value=self.Camera1.name,
-                  comment='Camera name from driver')
-            h.set('CAMINFO', value=self.Camera1.description)
-            h.set('CAMDRIVR', value=self.Camera1.driverversion,
-                  comment='Camera driver version')
-            h.set('BAYEROX', value=self.Camera1.bayeroffsetx,
-                  comment='Bayer offset X')
-            h.set('BAYEROY', value=self.Camera1.bayeroffsety,
-                  comment='Bayer offset Y')
-            h.set('PIXSIZEX', value=self.Camera1.pixelsizex,
-                  comment='Pixel size (microns) in X direction')
-            h.set('PIXSIZEY', value=self.Camera1.pixelsizey,
-                  comment='Pixel size (microns) in Y direction')
-            h.set('CCDNAME', value=self.Camera1.sensorname,
-                  comment='Sensor name from driver')
-            h.set('CCDTYPE', value=self.Camera1.sensortype,
-                  comment='CCD type from driver')
-            binx, biny = self.Camera1.binning()
-            h.set('BINX', value=binx, comment='X Binning')
-            h.set('BINY', value=biny, comment='Y Binning')
-            h.set('BINNING', value=f'{binx}, {biny}', comment='Binning')
-            h.set('DETSIZE', value=str(self.Camera1.camerasize()),
-                  comment='Size of detector in pixels')
-            h.set('DETTEMP', value=self.Camera1.ccdtemperature(),
-                  comment='Detector temperature (degrees C)')
-            h.set('DETSETP', value=self.Camera1.ccdsetpoint(),
-                  comment='Detector set point (degrees C)')
-            h.set('COOLON', value=self.Camera1.cooleron(),
-                  comment='Detector cooler on?')
-            h.set('COOLPWR', value=self.Camera1.coolerpower(),
-                  comment='Cooler power ouput (%)')
-            h.set('EPERADU', value=self.Camera1.electronsperadu(),
-                  comment='Gain in electrons per adu')
-            h.set('GAIN', value=self.Camera1.gain(),
-                  comment='Gain in camera units (db?)')
-            h.set('EXPTIME', value=self.Camera1.lastexposureduration(),
-                  comment='Exposure duration (seconds)')
-            h.set('EXPSTART', value=self.Camera1.lastexposurestarttime(),
-                  comment='Start time of last exposure')
-            h.set('NUMX', value=self.Camera1.numx(),
-                  comment='Window size (pixels) in X')
-            h.set('NUMY', value=self.Camera1.numy(),
-                  comment='Window size (pixels) in Y')
-            h.set('STARTX', value=self.Camera1.startx(),
-                  comment='Starting X pixel of window')
-            h.set('STARTY', value=self.Camera1.starty(),
-                  comment='Starting Y pixel of window')
-            # Filter Wheel1
-            h.set('FWNAME', value=self.FilterWheel1.name,
-                  comment='Filter wheel name from driver')
-            h.set('FWINFO', value=self.FilterWheel1.description)
-            h.set('FWDRIVR', value=self.FilterWheel1.driverversion,
-                  comment='Filter wheel driver version')
-            pos, name = self.FilterWheel1.position()
-            h.set('FILTER', value=name, comment='Filter name')
-            h.set('FILTPOS', value=pos, comment='Filter position')
-            # Focuser1
-            h.set('FOCNAME', value=self.Focuser1.name,
-                  comment='Focuser name from driver')
-            h.set('FOCINFO', value=self.Focuser1.description)
-            h.set('FOCDRIVR', value=self.Focuser1.driverversion,
-                  comment='Focuser driver version')
-            h.set('FOCUSPOS', value=self.Focuser1.position(),
-                  comment='Focuser position')
-            h.set('TEMPCOMP', value=self.Focuser1.tempcomp(),
-                  comment='Temperature compensation active?')
-            h.set('FOCTEMP', value=self.Focuser1.temperature(),
-                  comment='Focuser temperature (degrees C)')
-        return h
+            cards = {'UT': (now, 'Computer UT at end of exposure')}
+            table = POST_CARDS
+        if general is False:
+            cards = {}
+        memo = {}
+        for keyword, devname, source, comment, depends in table:
+            if include is not None and devname not in include:
+                continue
+            if devname[-1] == '1':
+                devname = f'{devname[:-1]}{unit}'
+            dev = getattr(self, devname)
+            if dev is None:
+                continue
+            cards[keyword] = (self._card_value(dev, source, depends, memo),
+                              comment)
+        return header_from_dict(cards)
+
+    def debayer(self, data, h, method='bilinear', rotate=False, camera=None):
+        """Demosaic a raw frame from camera (default Camera1) as returned by
+        imagearray (indexed [x, y]) and build the HDU(s) to write.
+
+        The Bayer phase comes from the camera's offsets and the subframe start
+        in the header.  The result gets the same orientation change that
+        expose applies to raw frames.  Depending on the debayer_output option
+        this returns a PrimaryHDU holding an RGB cube or an HDUList with one
+        ImageHDU per channel.
+        """
+        if camera is None:
+            camera = self.Camera1
+        phase = bayer_phase(camera.bayeroffsetx, camera.bayeroffsety,
+                            startx=h.get('STARTX', 0) or 0,
+                            starty=h.get('STARTY', 0) or 0)
+        rgb = demosaic(data.T, phase=phase, method=method)
+        if np.issubdtype(data.dtype, np.integer):
+            # Back to the compact raw dtype rather than writing float32
+            info = np.iinfo(data.dtype)
+            maxadu = camera.maxadu or info.max
+            rgb = np.clip(np.rint(rgb), max(info.min, 0), min(info.max, maxadu))
+            rgb = rgb.astype(data.dtype)
+        if rotate is True:
+            # Equivalent of np.rot90 on the [x, y] raw frame
+            rgb = rgb[:, ::-1, :]
+        else:
+            # Keep the [x, y] layout that raw frames are written with
+            rgb = rgb.transpose(0, 2, 1)
+        h.set('DEBAYER', value=method, comment='Demosaic method')
+        if self.options.get('debayer_output', 'cube') == 'channels':
+            hdus = [fits.PrimaryHDU(header=h)]
+            for i, color in enumerate(['R', 'G', 'B']):
+                hdus.append(fits.ImageHDU(data=rgb[i], name=color))
+            return fits.HDUList(hdus)
+        h.set('CTYPE3', value='RGB', comment='Color channels R, G, B')
+        return fits.PrimaryHDU(data=rgb, header=h)
 
     def expose(self, exptime=0, filter='L', imtype='light',
                filename=None):
         """Method to take an exposure with the specified parameters and write
         a FITS file.
         """
+        if self.is_light(imtype) is True and self.safe is False:
+            raise ObservatoryError('Observatory is not safe, will not expose')
         if self.is_light(imtype) is False\
            and self.options['filter_as_dark'] is not None:
             # Override filter if imtype specifies dark
-            self.FilterWheel1.set_position(self.options['filter_as_dark'])
+            self.change_filter(self.options['filter_as_dark'])
         else:
             # Set filter
-            self.FilterWheel1.set_position(filter)
+            self.change_filter(filter)
         h = self.collect_metadata(pre=True)
         h.set('IMTYPE', imtype, 'Image Type')
         log.info(f'Starting {exptime} second exposure')
-        self.Camera1.startexposure(exptime, light=self.is_light(imtype))
+        with self.safety_lock:
+            # make_safe() may have run during the filter change
+            if self.is_light(imtype) is True and self.safe is False:
+                raise ObservatoryError('Observatory is not safe, will not expose')
+            self.Camera1.startexposure(exptime, light=self.is_light(imtype))
         if exptime > 1:
             sleep(exptime-1)
         data = self.Camera1.waitfor_and_getimage()
         h += self.collect_metadata()
-        if data.shape[0] > data.shape[1]:
-            # Rotate data to long edge horizontal for display if needed
+        hdu = self.build_hdu(data, h)
+        if filename is not None:
+            self.write_hdu(hdu, filename)
+        return hdu
+
+    def expose_multi(self, cameras=['Camera1', 'Camera2'], exptime=0,
+                     imtype='light', filenames=None):
+        """Take simultaneous exposures on several cameras.
+
+        The startexposure PUTs are released together from one thread per
+        camera, then each camera is waited on and downloaded in parallel.
+        The telescope (and general) metadata is read once before and once
+        after for all frames, each frame gets its own camera, filter wheel
+        and focuser cards.  Filters are not changed.  Returns a list of HDUs
+        in the order of cameras and writes them to filenames if given.
+        """
+        cams = [getattr(self, name) for name in cameras]
+        for name, cam in zip(cameras, cams):
+            if cam is None:
+                raise ObservatoryError(f'{name} is not connected')
+        light = self.is_light(imtype)
+        if light is True and self.safe is False:
+            raise ObservatoryError('Observatory is not safe, will not expose')
+        pre = self.collect_metadata(pre=True)
+        pre.set('IMTYPE', imtype, 'Image Type')
+        barrier = threading.Barrier(len(cams))
+
+        def start(cam):
+            barrier.wait()
+            t0 = monotonic()
+            cam.startexposure(exptime, light=light)
+            return t0, monotonic()
+
+        def finish(name, cam):
+            data = cam.waitfor_and_getimage()
+            h = self.collect_metadata(unit=name[-1],
+                                      include=['Camera1', 'FilterWheel1',
+                                               'Focuser1'])
+            return data, h
+
+        log.info(f'Starting {exptime} second exposure on {", ".join(cameras)}')
+        with ThreadPoolExecutor(max_workers=len(cams)) as pool:
+            with self.safety_lock:
+                if light is True and self.safe is False:
+                    raise ObservatoryError('Observatory is not safe, will not expose')
+                started = [pool.submit(start, cam) for cam in cams]
+                failed = [f for f in started if f.exception() is not None]
+            if len(failed) > 0:
+                # Don't leave the other cameras exposing
+                for cam, f in zip(cams, started):
+                    if f.exception() is None and cam.canabort is True:
+                        try:
+                            cam.abortexposure()
+                        except AlpacaError as e:
+                            log.error(f'Failed to abort exposure: {e}')
+                raise failed[0].exception()
+            # The exposure began somewhere during its startexposure PUT, take
+            # the middle as the start and half the PUT time as the error
+            puts = [f.result() for f in started]
+            starts = [(t0 + t1) / 2 for t0, t1 in puts]
+            skew = max(starts) - min(starts)
+            log.info(f'Exposure start skew {skew*1000:.1f} ms')
+            if exptime > 1:
+                sleep(exptime-1)
+            frames = list(pool.map(finish, cameras, cams))
+        post = self.collect_metadata(include=['Telescope'])
+
+        hdus = []
+        for i, (name, cam) in enumerate(zip(cameras, cams)):
+            data, camera_header = frames[i]
+            h = pre.copy()
+            h += post
+            h += camera_header
+            h.set('CAMERA', value=name, comment='Observatory camera slot')
+            h.set('STSKEW', value=starts[i] - min(starts),
+                  comment='Exposure start delay after first camera (s)')
+            h.set('STSKEWER', value=(puts[i][1] - puts[i][0]) / 2,
+                  comment='Uncertainty of STSKEW (s), half the PUT time')
+            hdu = self.build_hdu(data, h, camera=cam)
+            if filenames is not None:
+                self.write_hdu(hdu, filenames[i])
+            hdus.append(hdu)
+        return hdus
+
+    def frame_filename(self, row, index, frame):
+        """File name for frame number frame of row index of a sequence."""
+        targname = ''.join(self.targname.split())
+        return (f"{targname}_{row['imtype']}_{row['filter']}_"
+                f"{float(row['exptime']):.0f}s_{index:02d}_{frame:03d}.fits")
+
+    def run_sequence(self, sequence, outdir='.', resume=True, verify=False):
+        """Take every frame of a Sequence with Camera1, writing one FITS
+        file per frame to outdir.  Returns the list of files written.
+
+        Written frames are recorded in a journal in outdir.  With resume
+        True, frames which the journal shows were already written (and whose
+        files are still intact, see SequenceJournal.is_done) are skipped, so
+        a sequence which was interrupted picks up at the first missing frame.
+        """
+        outdir = Path(outdir).expanduser().resolve()
+        outdir.mkdir(parents=True, exist_ok=True)
+        self.targname = getattr(sequence, 'targname', '')
+        targname = ''.join(self.targname.split())
+        journal = SequenceJournal(outdir / f'{targname}_journal.jsonl',
+                                  sequence_id(sequence), resume=resume)
+        files = []
+        try:
+            for index, row in enumerate(sequence.table):
+                frames = [frame for frame in range(int(row['nexp']))
+                          if not journal.is_done(index, frame, verify=verify)]
+                skipped = int(row['nexp']) - len(frames)
+                if skipped > 0:
+                    log.info(f'Skipping {skipped} frames of row {index} '
+                             f'already written')
+                if len(frames) == 0:
+                    continue
+                binx, biny = [int(b) for b in str(row['bin']).split('x')]
+                self.Camera1.set_binning(binx, biny)
+                for frame in frames:
+                    filename = outdir / self.frame_filename(row, index, frame)
+                    hdu = self.expose(exptime=float(row['exptime']),
+                                      filter=str(row['filter']),
+                                      imtype=str(row['imtype']))
+                    # The journal decides what is done, so replace any file
+                    # left by a frame which was never recorded
+                    if self.write_hdu(hdu, filename, overwrite=True) is True:
+                        journal.record(index, frame, filename)
+                        files.append(filename)
+        finally:
+            journal.close()
+        return files
+
+    def build_hdu(self, data, h, camera=None):
+        """Make the HDU for a frame from camera (default Camera1)."""
+        if camera is None:
+            camera = self.Camera1
+        # Rotate data to long edge horizontal for display if needed
+        rotate = data.shape[0] > data.shape[1]
+        method = self.options.get('debayer', None)
+        if method is not None and camera.sensortype == SENSORTYPE_RGGB:
+            if (h.get('BINX', 1) or 1) > 1 or (h.get('BINY', 1) or 1) > 1:
+                # Binned pixels mix colors, so there is no mosaic to undo
+                log.info('Not demosaicing binned frame')
+                method = None
+        if method is not None and camera.sensortype == SENSORTYPE_RGGB:
+            return self.debayer(data, h, method=method, rotate=rotate,
+                                camera=camera)
+        if rotate is True:
             data = np.rot90(data)
-        hdu = fits.PrimaryHDU(data=data, header=h)
-        if filename is None:
-            return hdu
+        return fits.PrimaryHDU(data=data, header=h)
+
+    def write_hdu(self, hdu, filename, overwrite=False):
+        """Write hdu to filename, returning True if it succeeded."""
+        fp = Path(filename).expanduser()
         try:
-            fp = Path(filename).expanduser()
             log.info(f'Writing file to {fp}')
-            hdu.writeto(fp)
+            hdu.writeto(fp, overwrite=overwrite)
         except:
             log.error(f'Failed to write file to {fp}')
-        finally:
-            return hdu
+            return False
+        return True
 
 
 if __name__ == '__main__':
@@ -0,0 +1,214 @@
+#!/usr/env/python
+import numpy as np
+from astropy import units as u
+from astropy.time import Time
+from astropy.table import Table
+
+from . import log, ObservatoryError
+
+##-------------------------------------------------------------------------
+## Night Planner
+##-------------------------------------------------------------------------
+# Sidereal hours per solar second
+SIDEREAL_RATE = 1.00273790935 / 3600
+
+
+def wrap_hours(ha):
+    """Wrap hour angles (hours) to the range [-12, 12)."""
+    return (np.asarray(ha) + 12) % 24 - 12
+
+
+class NightPlanner(object):
+    """Plan the order in which to observe many targets during one night.
+
+    Altitude, airmass and meridian crossing are computed for all targets at
+    once from the hour angle, so astropy is only needed to get the sidereal
+    time at the start of the night.  The execution order is built greedily:
+    at each step the visible target with the lowest cost is observed next,
+    where the cost is the slew time from the current pointing plus penalties
+    for a meridian flip and a filter change, plus `urgency` times the
+    remaining time before the target sets (so targets about to set are
+    preferred).
+
+    Targets are Sequence objects with `targname`, `ra` (hours) and `dec`
+    (degrees) attributes and a `table` as in ExampleSequence.txt.
+    """
+    def __init__(self, latitude, longitude, elevation=0, min_alt=30,
+                 slew_rate=3.0, settle=5, flip_time=60, filter_time=10,
+                 readout=5, urgency=0.01, step=300):
+        self.latitude = latitude      # degrees
+        self.longitude = longitude    # degrees, east positive
+        self.elevation = elevation    # meters
+        self.min_alt = min_alt        # degrees
+        self.slew_rate = slew_rate    # degrees per second, each axis
+        self.settle = settle          # seconds after each slew
+        self.flip_time = flip_time    # seconds for a meridian flip
+        self.filter_time = filter_time  # seconds for a filter change
+        self.readout = readout        # seconds per exposure
+        self.urgency = urgency        # cost per second of visibility left
+        self.step = step              # seconds to wait if nothing is up
+
+    @classmethod
+    def from_telescope(cls, telescope, **kwargs):
+        """Planner for the site configured in a Telescope device."""
+        return cls(telescope.sitelatitude(), telescope.sitelongitude(),
+                   elevation=telescope.siteelevation(), **kwargs)
+
+    def lst0(self, start):
+        """Local sidereal time (hours) at start."""
+        t = Time(start)
+        return t.sidereal_time('mean', longitude=self.longitude*u.deg).hour
+
+    def altitude(self, ha, dec):
+        """Altitude (degrees) for hour angle (hours) and dec (degrees)."""
+        lat = np.radians(self.latitude)
+        dec = np.radians(dec)
+        sinalt = np.sin(lat)*np.sin(dec)\
+                 + np.cos(lat)*np.cos(dec)*np.cos(np.radians(15*ha))
+        return np.degrees(np.arcsin(np.clip(sinalt, -1, 1)))
+
+    def airmass(self, alt):
+        """Kasten & Young (1989) airmass, infinite below the horizon."""
+        alt = np.asarray(alt, dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            X = 1 / (np.sin(np.radians(alt))
+                     + 0.50572*(alt + 6.07995)**-1.6364)
+        return np.where(alt > 0, X, np.inf)
+
+    def setting_ha(self, dec):
+        """Hour angle (hours) at which targets set below min_alt.  This is 12
+        for targets which never set and nan for ones which never rise that
+        high.
+        """
+        lat = np.radians(self.latitude)
+        dec = np.radians(np.asarray(dec, dtype=float))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cosH = (np.sin(np.radians(self.min_alt))
+                    - np.sin(lat)*np.sin(dec)) / (np.cos(lat)*np.cos(dec))
+        H = np.degrees(np.arccos(np.clip(cosH, -1, 1))) / 15
+        H = np.where(cosH < -1, 12, H)
+        return np.where(cosH > 1, np.nan, H)
+
+    def visibility(self, ra, dec, start, end):
+        """Altitude and airmass of all targets on a grid of times through the
+        night, plus the time of the next meridian crossing of each.
+
+        Returns a dict with `times` (Time, ntimes), `alt` and `airmass`
+        (ntargets x ntimes) and `transit` (Time, ntargets).
+        """
+        start = Time(start)
+        end = Time(end)
+        ra = np.asarray(ra, dtype=float)
+        dec = np.asarray(dec, dtype=float)
+        duration = (end - start).to_value(u.s)
+        dt = np.arange(0, duration + self.step, self.step)
+        lst = self.lst0(start) + dt*SIDEREAL_RATE
+        ha = wrap_hours(lst[np.newaxis, :] - ra[:, np.newaxis])
+        alt = self.altitude(ha, dec[:, np.newaxis])
+        to_transit = ((ra - self.lst0(start)) % 24) / SIDEREAL_RATE
+        return {'times': start + dt*u.s,
+                'alt': alt,
+                'airmass': self.airmass(alt),
+                'transit': start + to_transit*u.s,
+               }
+
+    def _durations(self, sequences):
+        durations = []
+        for seq in sequences:
+            t = seq.table
+            nexp = np.asarray(t['nexp'])
+            durations.append(np.sum(np.asarray(t['exptime'])*nexp)
+                             + np.sum(nexp)*self.readout)
+        return np.array(durations, dtype=float)
+
+    def plan(self, sequences, start, end):
+        """Choose an execution order for sequences between start and end.
+
+        Returns a Table with one row per scheduled sequence.  Sequences which
+        can not be fit in the night are left out and logged.
+        """
+        start = Time(start)
+        night = (Time(end) - start).to_value(u.s)
+        n = len(sequences)
+        if n == 0:
+            raise ObservatoryError('No sequences to plan')
+        ra = np.array([s.ra for s in sequences], dtype=float)
+        dec = np.array([s.dec for s in sequences], dtype=float)
+        duration = self._durations(sequences)
+        first_filter = np.array([str(s.table['filter'][0]) for s in sequences])
+        last_filter = [str(s.table['filter'][-1]) for s in sequences]
+        set_ha = self.setting_ha(dec)
+        lst0 = self.lst0(start)
+
+        todo = ~np.isnan(set_ha)
+        order = []
+        begin = []
+        overheads = []
+        hour_angles = []
+        T = 0.0
+        ha0 = None
+        dec0 = None
+        side0 = None
+        filter0 = None
+        while T < night and np.any(todo):
+            lst = lst0 + T*SIDEREAL_RATE
+            ha_start = wrap_hours(lst - ra)
+            # Hour angle at the end of the block, unwrapped so a block which
+            # crosses the meridian goes from negative to positive
+            ha_end = ha_start + duration*SIDEREAL_RATE
+            up = ((ha_start > -set_ha) & (ha_end < set_ha)) | (set_ha >= 12)
+            fits_night = T + duration <= night
+            ok = todo & up & fits_night
+            if not np.any(ok):
+                T += self.step
+                continue
+
+            side = ha_start >= 0
+            overhead = np.zeros(n)
+            if ha0 is not None:
+                slew = np.maximum(np.abs(wrap_hours(ha_start - ha0))*15,
+                                  np.abs(dec - dec0)) / self.slew_rate
+                overhead += slew + self.settle
+                overhead += np.where(side != side0, self.flip_time, 0)
+            if filter0 is not None:
+                overhead += np.where(first_filter != filter0,
+                                     self.filter_time, 0)
+            # Flip needed partway through the block
+            overhead += np.where((ha_start < 0) & (ha_end >= 0),
+                                 self.flip_time, 0)
+            cost = overhead + self.urgency*(set_ha - ha_start)/SIDEREAL_RATE
+            cost = np.where(ok, cost, np.inf)
+            i = int(np.argmin(cost))
+
+            order.append(i)
+            begin.append(T + overhead[i])
+            overheads.append(overhead[i])
+            hour_angles.append(wrap_hours(lst0 + begin[-1]*SIDEREAL_RATE - ra[i]))
+            todo[i] = False
+            T = begin[-1] + duration[i]
+            ha0 = wrap_hours(ha_end[i])
+            dec0 = dec[i]
+            side0 = ha0 >= 0
+            filter0 = last_filter[i]
+
+        skipped = [sequences[i].targname
+                   for i in np.where(todo | np.isnan(set_ha))[0]]
+        log.info(f'Planned {len(order)} of {n} sequences')
+        if len(skipped) > 0:
+            log.debug(f'  Could not schedule: {", ".join(skipped)}')
+        order = np.array(order, dtype=int)
+        begin = np.array(begin, dtype=float)
+        ha = np.array(hour_angles, dtype=float)
+        alt = self.altitude(ha, dec[order])
+        t = Table()
+        t['targname'] = [sequences[i].targname for i in order]
+        t['start'] = (start + begin*u.s).isot
+        t['end'] = (start + (begin + duration[order])*u.s).isot
+        t['duration'] = duration[order]
+        t['overhead'] = np.array(overheads, dtype=float)
+        t['ha'] = ha
+        t['alt'] = alt
+        t['airmass'] = self.airmass(alt)
+        t['filter'] = first_filter[order]
+        t['side'] = np.where(ha < 0, 'E', 'W')
+        return t
@@ -0,0 +1,271 @@
+#!/usr/env/python
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+from . import log, AlpacaError
+from .devices import IMAGE_DEADLINE, SLEW_DEADLINE
+from .transport import TransportPolicy
+
+##-------------------------------------------------------------------------
+## Alpaca Proxy
+##-------------------------------------------------------------------------
+# Properties which do not change on a given connection.  These are cached
+# until a PUT to the device (e.g. connected) invalidates them.
+STATIC_COMMANDS = ['name', 'description', 'driverinfo', 'driverversion',
+                   'supportedactions', 'interfaceversion',
+                   # Camera
+                   'bayeroffsetx', 'bayeroffsety', 'exposuremax',
+                   'exposuremin', 'exposureresolution', 'fullwellcapacity',
+                   'gainmax', 'gainmin', 'gains', 'hasshutter', 'maxadu',
+                   'maxbinx', 'maxbiny', 'pixelsizex', 'pixelsizey',
+                   'readoutmodes', 'sensorname', 'sensortype', 'cameraxsize',
+                   'cameraysize',
+                   # Focuser
+                   'absolute', 'maxincrement', 'maxstep', 'stepsize',
+                   'tempcompavailable',
+                   # Filter wheel
+                   'focusoffsets', 'names',
+                   # Telescope
+                   'alignmentmode', 'aperturearea', 'aperturediameter',
+                   'equatorialsystem', 'focallength', 'trackingrates',
+                   'axisrates',
+                   # Switch
+                   'maxswitch',
+                   # Management API
+                   'apiversions', 'configureddevices',
+                   ]
+# Commands which are never cached, only coalesced.  These are image downloads,
+# which get the long IMAGE_DEADLINE and do not hold up other requests to the
+# device while they run.
+UNCACHED_COMMANDS = ['imagearray', 'imagearrayvariant']
+
+
+# The transaction ID fields of an Alpaca JSON response
+TRANSACTION_ID = re.compile(rb'"(ClientTransactionID|ServerTransactionID)"\s*:\s*-?\d+')
+
+
+def is_static(command):
+    return command in STATIC_COMMANDS or command.startswith('can')
+
+
+class _Call(object):
+    """An upstream GET in flight, shared by every client asking for it."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.status = 500
+        self.body = b''
+
+
+class AlpacaProxy(object):
+    """Local Alpaca compatible server which forwards to one upstream Alpaca
+    server.
+
+    All clients share one upstream connection per device, and requests to a
+    device are sent upstream one at a time.  Identical GETs which arrive while
+    one is in flight wait for and share its response.  Responses to GETs are
+    cached for `ttl` seconds (static properties until the next PUT to the
+    device), and any PUT invalidates the cache for that device.  Each client
+    sees its own ClientTransactionID echoed back.
+    """
+    def __init__(self, IP, port=11111, host='127.0.0.1', listen_port=11112,
+                 ttl=0.5, transport=None):
+        self.upstream = f"http://{IP}:{port}"
+        self.host = host
+        self.listen_port = listen_port
+        self.ttl = ttl
+        self.transport = transport
+        self.clientID = int(random.random() * 65535)
+        self.transactionID = 0
+        self.server_transactionID = 0
+        self.lock = threading.Lock()
+        self.connections = {}  # device path -> (TransportPolicy, Lock)
+        self.inflight = {}     # (device path, command, params) -> _Call
+        self.cache = {}        # same key -> (expires, status, body)
+        self.counts = {'requests': 0, 'upstream': 0, 'coalesced': 0,
+                       'cache_hits': 0, 'puts': 0}
+        self.server = None
+        self.thread = None
+
+    def _connection(self, device):
+        with self.lock:
+            if device not in self.connections:
+                if self.transport is None:
+                    transport = TransportPolicy()
+                elif type(self.transport) == dict:
+                    transport = TransportPolicy(**self.transport)
+                else:
+                    transport = self.transport
+                self.connections[device] = (transport, threading.Lock())
+            return self.connections[device]
+
+    def _next_ids(self):
+        with self.lock:
+            self.transactionID = self.transactionID % 4294967295 + 1
+            return {'ClientID': self.clientID,
+                    'ClientTransactionID': self.transactionID}
+
+    def _upstream(self, method, device, command, params):
+        transport, device_lock = self._connection(device)
+        payload = {**params, **self._next_ids()}
+        url = f"{self.upstream}{device}{command}"
+        with self.lock:
+            self.counts['upstream'] += 1
+        try:
+            if method == 'GET' and command in UNCACHED_COMMANDS:
+                r = transport.get(url, payload, deadline=IMAGE_DEADLINE,
+                                  read_timeout=IMAGE_DEADLINE, hedge=False)
+            else:
+                with device_lock:
+                    if method == 'GET':
+                        r = transport.get(url, payload, hedge=False)
+                    else:
+                        # The client's own timeout bounds a synchronous
+                        # action such as park, so allow the longest
+                        r = transport.put(url, payload, deadline=SLEW_DEADLINE,
+                                          read_timeout=SLEW_DEADLINE)
+        except AlpacaError as e:
+            log.error(f'Proxy {method} {device}{command} failed: {e}')
+            return 500, str(e).encode()
+        return r.status_code, r.content
+
+    def get(self, device, command, params):
+        """Return (status, body) for a GET, from cache, from an in flight
+        request for the same thing, or from upstream.
+        """
+        key = (device, command,
+               tuple(sorted((k.lower(), v) for k, v in params.items())))
+        with self.lock:
+            self.counts['requests'] += 1
+            cached = self.cache.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self.counts['cache_hits'] += 1
+                return cached[1], cached[2]
+            call = self.inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.inflight[key] = call
+            else:
+                self.counts['coalesced'] += 1
+        if leader is False:
+            call.done.wait()
+            return call.status, call.body
+        try:
+            call.status, call.body = self._upstream('GET', device, command,
+                                                    params)
+        finally:
+            with self.lock:
+                del self.inflight[key]
+                if call.status == 200 and command not in UNCACHED_COMMANDS:
+                    ttl = float('inf') if is_static(command) else self.ttl
+                    self.cache[key] = (time.monotonic() + ttl, call.status,
+                                       call.body)
+            call.done.set()
+        return call.status, call.body
+
+    def put(self, device, command, params):
+        with self.lock:
+            self.counts['requests'] += 1
+            self.counts['puts'] += 1
+            for key in [k for k in self.cache.keys() if k[0] == device]:
+                del self.cache[key]
+        status, body = self._upstream('PUT', device, command, params)
+        with self.lock:
+            # Drop anything cached while the PUT was in progress as well
+            for key in [k for k in self.cache.keys() if k[0] == device]:
+                del self.cache[key]
+        return status, body
+
+    def respond(self, body, client_params):
+        """Rewrite transaction IDs in a JSON response for one client.
+
+        The two ID fields are substituted in place rather than parsing and
+        re-serializing the body, which for a shared image download would
+        mean re-encoding the whole frame for every client.
+        """
+        with self.lock:
+            self.server_transactionID = self.server_transactionID % 4294967295 + 1
+            ids = {b'ServerTransactionID': self.server_transactionID}
+        tid = client_params.get('clienttransactionid', None)
+        try:
+            ids[b'ClientTransactionID'] = int(tid) if tid is not None else 0
+        except ValueError:
+            ids[b'ClientTransactionID'] = 0
+        return TRANSACTION_ID.sub(lambda m: b'"%s": %d' % (m.group(1),
+                                                           ids[m.group(1)]),
+                                  body, count=2)
+
+    def start(self):
+        """Start serving on a background thread."""
+        Handler = type('Handler', (_Handler,), {'proxy': self})
+        self.server = ThreadingHTTPServer((self.host, self.listen_port),
+                                          Handler)
+        self.server.daemon_threads = True
+        self.listen_port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        log.info(f'Alpaca proxy for {self.upstream} listening on '
+                 f'{self.host}:{self.listen_port}')
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    proxy = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        log.debug(f'Proxy: {format % args}')
+
+    def _split(self):
+        """Return (device path, command, params) for the request.  Alpaca
+        parameter names are case insensitive, params keeps the client's
+        spelling for forwarding.
+        """
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        if length > 0:
+            body = self.rfile.read(length).decode()
+            params.update(dict(parse_qsl(body)))
+        device, _, command = url.path.rpartition('/')
+        return device + '/', command.lower(), params
+
+    def _reply(self, status, body, params):
+        lower = {k.lower(): v for k, v in params.items()}
+        if status == 200:
+            body = self.proxy.respond(body, lower)
+        self.send_response(status)
+        content_type = 'application/json' if status == 200 else 'text/plain'
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _forwarded(self, params):
+        # The proxy supplies its own ClientID and ClientTransactionID
+        return {k: v for k, v in params.items()
+                if k.lower() not in ['clientid', 'clienttransactionid']}
+
+    def do_GET(self):
+        device, command, params = self._split()
+        status, body = self.proxy.get(device, command, self._forwarded(params))
+        self._reply(status, body, params)
+
+    def do_PUT(self):
+        device, command, params = self._split()
+        status, body = self.proxy.put(device, command, self._forwarded(params))
+        self._reply(status, body, params)
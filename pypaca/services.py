@@ -0,0 +1,182 @@
+#!/usr/env/python
+from concurrent.futures import ThreadPoolExecutor
+import math
+import threading
+import time
+
+from . import log
+
+##-------------------------------------------------------------------------
+## Background Services
+##-------------------------------------------------------------------------
+def altaz(ha, dec, lat):
+    """Altitude and azimuth (degrees, azimuth east of north) of hour angle ha
+    (hours) and declination dec (degrees) seen from latitude lat (degrees).
+    """
+    h = math.radians(ha * 15)
+    d = math.radians(dec)
+    phi = math.radians(lat)
+    sin_alt = math.sin(d)*math.sin(phi) + math.cos(d)*math.cos(phi)*math.cos(h)
+    alt = math.asin(max(-1, min(1, sin_alt)))
+    az = math.atan2(-math.cos(d)*math.sin(h),
+                    math.sin(d)*math.cos(phi) - math.cos(d)*math.sin(phi)*math.cos(h))
+    return math.degrees(alt), math.degrees(az) % 360
+
+
+class Service(object):
+    """Calls poll() every interval seconds on a background thread until
+    stopped.  A failed poll is logged and the loop carries on.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self.thread = None
+
+    def poll(self):
+        raise NotImplementedError
+
+    def start(self):
+        self._stop.clear()
+
+        def run():
+            while not self._stop.is_set():
+                t_start = time.monotonic()
+                try:
+                    self.poll()
+                except Exception as e:
+                    log.warning(f'{type(self).__name__} poll failed: {e}')
+                self._stop.wait(max(0, self.interval - (time.monotonic() - t_start)))
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class DomeSlaver(Service):
+    """Keep the Observatory's Dome pointed at the Telescope azimuth.
+
+    Each poll reads both azimuths with a deadline of one interval and only
+    commands the dome when it has stopped and is more than tolerance degrees
+    off.  Nothing is moved while the observatory is unsafe.
+    """
+    def __init__(self, obs, interval=5, tolerance=3):
+        Service.__init__(self, interval)
+        self.obs = obs
+        self.tolerance = tolerance
+        self.moves = 0
+
+    def poll(self):
+        if self.obs.safe is False:
+            return
+        dome = self.obs.Dome
+        t = self.obs.Telescope
+        target = t.get('azimuth', quiet=True, deadline=self.interval)['Value']
+        if target is None:
+            return
+        if dome.get('slewing', quiet=True, deadline=self.interval)['Value'] is not False:
+            return
+        az = dome.get('azimuth', quiet=True, deadline=self.interval)['Value']
+        if az is None:
+            return
+        offset = (target - az + 180) % 360 - 180
+        if abs(offset) > self.tolerance:
+            log.info(f'Moving dome {az:.1f} -> {target:.1f}')
+            dome.slewtoazimuth(target)
+            self.moves += 1
+
+
+class SafetyWatcher(Service):
+    """Watch the SafetyMonitor and ObservingConditions of an Observatory.
+
+    limits maps an ObservingConditions property to [min, max] (either may be
+    None), e.g. {'windspeed': [None, 15], 'humidity': [None, 90]}.  All
+    readings in a poll are made in parallel with a deadline of one interval.
+    A reading which fails is unsafe if unknown_is_unsafe is True.
+
+    Only transitions are acted on: going unsafe calls obs.make_safe() once
+    and every callback with (False, reasons).  The observatory is only
+    declared safe again once every reading has been safe for safe_delay
+    seconds, then callbacks get (True, []).
+    """
+    def __init__(self, obs, interval=2, limits=None, safe_delay=300,
+                 unknown_is_unsafe=True):
+        Service.__init__(self, interval)
+        self.obs = obs
+        self.limits = {} if limits is None else limits
+        self.safe_delay = safe_delay
+        self.unknown_is_unsafe = unknown_is_unsafe
+        self.callbacks = []
+        self.reasons = []
+        self.last_unsafe = None
+        self.pool = None
+
+    def _reads(self):
+        reads = []
+        if self.obs.SafetyMonitor is not None:
+            reads.append((self.obs.SafetyMonitor, 'issafe'))
+        if self.obs.ObservingConditions is not None:
+            reads.extend([(self.obs.ObservingConditions, p)
+                          for p in self.limits.keys()])
+        return reads
+
+    def check(self):
+        """Return a list of reasons it is unsafe (empty if safe)."""
+        reads = self._reads()
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=1 + len(self.limits))
+        values = self.pool.map(lambda r: r[0].get(r[1], quiet=True,
+                                                  deadline=self.interval)['Value'],
+                               reads)
+        reasons = []
+        for (dev, command), value in zip(reads, values):
+            if value is None:
+                if self.unknown_is_unsafe is True:
+                    reasons.append(f'{command} unknown')
+            elif command == 'issafe':
+                if value is not True:
+                    reasons.append('safety monitor unsafe')
+            else:
+                low, high = self.limits[command]
+                if (low is not None and value < low)\
+                   or (high is not None and value > high):
+                    reasons.append(f'{command} = {value}')
+        return reasons
+
+    def poll(self):
+        reasons = self.check()
+        now = time.monotonic()
+        if len(reasons) > 0:
+            self.last_unsafe = now
+            self.reasons = reasons
+            if self.obs.safe is True:
+                log.warning(f'Observatory unsafe: {", ".join(reasons)}')
+                self.obs.make_safe(reasons)
+                self.notify(False, reasons)
+        elif self.obs.safe is False:
+            if self.last_unsafe is None:
+                # Made unsafe by a direct make_safe() call, start the clock now
+                self.last_unsafe = now
+            if now - self.last_unsafe >= self.safe_delay:
+                log.info('Observatory safe')
+                self.obs.safe = True
+                self.reasons = []
+                self.last_unsafe = None
+                self.notify(True, [])
+
+    def notify(self, safe, reasons):
+        for callback in self.callbacks:
+            try:
+                callback(safe, reasons)
+            except Exception as e:
+                log.error(f'Safety callback failed: {e}')
+
+    def stop(self):
+        Service.stop(self)
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,226 @@
+#!/usr/env/python
+from pathlib import Path
+import datetime
+import threading
+import time
+
+import numpy as np
+
+from . import log
+
+##-------------------------------------------------------------------------
+## Telemetry Recorder
+##-------------------------------------------------------------------------
+class TelemetryRecorder(object):
+    """Record device readings in preallocated NumPy ring buffers.
+
+    channels maps a channel name to a function returning the current value.
+    Each channel is stored as one contiguous float32 row (so queries read
+    columns, not records) alongside a float64 array of unix times.  When the
+    buffer is full the oldest samples are overwritten, so flush() them to disk
+    first if they need to be kept: flush() writes the samples recorded since
+    the previous flush as one compressed npz file in flush_dir.
+    """
+    def __init__(self, channels, capacity=100000, flush_dir=None):
+        self.names = list(channels.keys())
+        self.sources = [channels[name] for name in self.names]
+        self.capacity = capacity
+        self.times = np.full(capacity, np.nan, dtype=np.float64)
+        self.values = np.full((len(self.names), capacity), np.nan,
+                              dtype=np.float32)
+        self.count = 0      # samples recorded since creation
+        self.flushed = 0    # value of count at the last flush
+        self.overrun = False
+        self.flush_dir = None if flush_dir is None\
+                         else Path(flush_dir).expanduser()
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self.thread = None
+
+    @classmethod
+    def for_observatory(cls, obs, **kwargs):
+        """Recorder for the usual trend channels of an Observatory's
+        connected devices.  Readings are quiet GETs, so sampling does not log.
+        """
+        def reading(dev, command):
+            return lambda: dev.get(command, quiet=True)['Value']
+
+        channels = {}
+        if obs.Camera1 is not None:
+            channels['ccdtemp'] = reading(obs.Camera1, 'ccdtemperature')
+            if obs.Camera1.cangetcoolerpower is True:
+                channels['coolerpower'] = reading(obs.Camera1, 'coolerpower')
+        if obs.Focuser1 is not None:
+            channels['foctemp'] = reading(obs.Focuser1, 'temperature')
+            channels['focuspos'] = reading(obs.Focuser1, 'position')
+        if obs.Telescope is not None:
+            channels['alt'] = reading(obs.Telescope, 'altitude')
+            channels['az'] = reading(obs.Telescope, 'azimuth')
+            channels['tracking'] = reading(obs.Telescope, 'tracking')
+        return cls(channels, **kwargs)
+
+    def record(self, values, t=None):
+        """Add one sample.  values are in the order of self.names, None for a
+        failed reading.
+        """
+        if t is None:
+            t = time.time()
+        row = np.array([np.nan if v is None else float(v) for v in values],
+                       dtype=np.float32)
+        with self.lock:
+            i = self.count % self.capacity
+            self.times[i] = t
+            self.values[:, i] = row
+            self.count += 1
+            if self.count - self.flushed > self.capacity:
+                if self.flush_dir is not None and self.overrun is False:
+                    log.warning('Telemetry buffer overran unflushed samples')
+                    self.overrun = True
+                self.flushed = self.count - self.capacity
+
+    def sample(self):
+        """Read every channel once and record the result."""
+        values = []
+        for name, source in zip(self.names, self.sources):
+            try:
+                values.append(source())
+            except Exception as e:
+                log.warning(f'Telemetry read of {name} failed: {e}')
+                values.append(None)
+        self.record(values)
+
+    def _segments(self, first, last):
+        """Physical (start, stop) slices, in time order, of the samples with
+        counts first <= n < last.
+        """
+        first = max(first, self.count - self.capacity)
+        if last <= first:
+            return []
+        a = first % self.capacity
+        b = a + (last - first)
+        if b <= self.capacity:
+            return [(a, b)]
+        return [(a, self.capacity), (0, b - self.capacity)]
+
+    def _columns(self, first, last, t0=None, t1=None, channels=None):
+        """Copy out times and channel values between t0 and t1."""
+        if channels is None:
+            channels = self.names
+        rows = [self.names.index(name) for name in channels]
+        times = []
+        values = []
+        with self.lock:
+            for a, b in self._segments(first, last):
+                # Times increase within a segment so the range is a slice
+                seg = self.times[a:b]
+                i0 = 0 if t0 is None else np.searchsorted(seg, t0, 'left')
+                i1 = len(seg) if t1 is None else np.searchsorted(seg, t1, 'right')
+                times.append(seg[i0:i1].copy())
+                values.append(self.values[rows, a+i0:a+i1])
+        if len(times) == 0:
+            return np.empty(0), np.empty((len(rows), 0), dtype=np.float32)
+        return np.concatenate(times), np.concatenate(values, axis=1)
+
+    def query(self, t0=None, t1=None, channels=None, every=1, bin=None):
+        """Samples between unix times t0 and t1 as a dict of arrays with a
+        'time' entry and one entry per channel.
+
+        every keeps every n-th sample.  bin (seconds) instead averages the
+        samples in bins of that length, ignoring failed (nan) readings.
+        """
+        if channels is None:
+            channels = self.names
+        t, v = self._columns(0, self.count, t0=t0, t1=t1, channels=channels)
+        if bin is not None and len(t) > 0:
+            t, v = bin_mean(t, v, bin)
+        elif every > 1:
+            t, v = t[::every], v[:, ::every]
+        result = {'time': t}
+        for i, name in enumerate(channels):
+            result[name] = v[i]
+        return result
+
+    def flush(self):
+        """Write the samples recorded since the last flush to an npz file in
+        flush_dir and return its path.
+        """
+        if self.flush_dir is None:
+            return None
+        last = self.count
+        t, v = self._columns(self.flushed, last)
+        if len(t) == 0:
+            return None
+        self.flush_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.datetime.utcfromtimestamp(t[0]).strftime('%Y%m%dT%H%M%S.%f')
+        file = self.flush_dir / f'telemetry_{stamp}.npz'
+        n = 1
+        while file.exists():
+            # Two flushes starting in the same microsecond
+            file = self.flush_dir / f'telemetry_{stamp}_{n}.npz'
+            n += 1
+        np.savez_compressed(file, time=t,
+                            **{name: v[i] for i, name in enumerate(self.names)})
+        self.flushed = last
+        self.overrun = False
+        log.debug(f'Flushed {len(t)} telemetry samples to {file}')
+        return file
+
+    def start(self, interval=10, flush_every=600):
+        """Sample every interval seconds (and flush every flush_every seconds
+        if flush_dir is set) on a background thread.
+        """
+        self._stop.clear()
+
+        def run():
+            last_flush = time.monotonic()
+            while not self._stop.is_set():
+                t_start = time.monotonic()
+                self.sample()
+                if t_start - last_flush >= flush_every:
+                    self.flush()
+                    last_flush = t_start
+                self._stop.wait(max(0, interval - (time.monotonic() - t_start)))
+            self.flush()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def bin_mean(t, v, bin):
+    """Average times t and rows of v in bins of bin seconds, ignoring nan."""
+    index = ((t - t[0]) // bin).astype(np.int64)
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(index)) + 1])
+    n = np.diff(np.concatenate([starts, [len(t)]]))
+    good = ~np.isnan(v)
+    sums = np.add.reduceat(np.where(good, v, 0), starts, axis=1)
+    counts = np.add.reduceat(good, starts, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (sums / counts).astype(np.float32)
+    return np.add.reduceat(t, starts) / n, means
+
+
+def load(directory, t0=None, t1=None):
+    """Read flushed telemetry files back as one dict of arrays, limited to
+    unix times t0 to t1.
+    """
+    files = sorted(Path(directory).expanduser().glob('telemetry_*.npz'))
+    parts = {}
+    for file in files:
+        with np.load(file) as f:
+            t = f['time']
+            keep = np.ones(len(t), dtype=bool)
+            if t0 is not None:
+                keep &= t >= t0
+            if t1 is not None:
+                keep &= t <= t1
+            if not np.any(keep):
+                continue
+            for name in f.files:
+                parts.setdefault(name, []).append(f[name][keep])
+    return {name: np.concatenate(arrays) for name, arrays in parts.items()}
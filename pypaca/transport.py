@@ -0,0 +1,187 @@
+#!/usr/env/python
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+import requests
+
+from . import log, AlpacaError
+
+
+##-------------------------------------------------------------------------
+## Transport Policy
+##-------------------------------------------------------------------------
+class TransportPolicy(object):
+    """Timeouts, retries and hedging for the HTTP requests made by a Device.
+
+    connect_timeout and read_timeout are handed to requests for each attempt.
+    deadline is the total time (seconds) allowed for one call including all
+    retries.  GETs are idempotent, so they are retried up to `retries` times
+    with exponential backoff and full jitter.  PUTs are never retried.  If
+    hedge_after is set, a duplicate GET is issued when the first has not
+    answered within that many seconds and the first response wins.  Each
+    attempt of a hedged GET runs on its own thread and the hedge has its own
+    connection, so a slow loser never holds up a later call.
+    """
+    def __init__(self, connect_timeout=3.05, read_timeout=10, deadline=30,
+                 retries=2, backoff=0.25, hedge_after=None, history=1000):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self.session = requests.Session()
+        self.latencies = deque(maxlen=history)
+        self.counts = {'requests': 0, 'retries': 0, 'timeouts': 0,
+                       'errors': 0, 'hedges': 0, 'hedge_wins': 0}
+        self.lock = threading.Lock()
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def _timeout(self, remaining, read_timeout=None):
+        if read_timeout is None:
+            read_timeout = self.read_timeout
+        return (min(self.connect_timeout, remaining),
+                min(read_timeout, remaining))
+
+    def _send(self, method, url, data, timeout, session=None):
+        if session is None:
+            session = self.session
+        t0 = time.monotonic()
+        try:
+            if method == 'GET':
+                # Alpaca takes GET parameters in the query string
+                return session.request(method, url, params=data,
+                                       timeout=timeout)
+            return session.request(method, url, data=data, timeout=timeout)
+        finally:
+            # Failures count too, they are the tail we want to see
+            with self.lock:
+                self.latencies.append(time.monotonic() - t0)
+
+    def _background(self, *args, fresh=False):
+        """Run _send on a new daemon thread and return a Future for it.  With
+        fresh=True the request uses its own, short lived, connection.
+        """
+        future = Future()
+
+        def run():
+            session = requests.Session() if fresh is True else None
+            try:
+                future.set_result(self._send(*args, session=session))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                if session is not None:
+                    session.close()
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def _hedged_get(self, url, data, remaining, read_timeout):
+        timeout = self._timeout(remaining, read_timeout)
+        first = self._background('GET', url, data, timeout)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result()
+        self._count('hedges')
+        log.debug(f'  Hedging GET {url}')
+        remaining -= self.hedge_after
+        second = self._background('GET', url, data,
+                                  self._timeout(remaining, read_timeout),
+                                  fresh=True)
+        futures = [first, second]
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if f is second:
+                        self._count('hedge_wins')
+                    return f.result()
+        # Both attempts failed: surface the exception from the first
+        return first.result()
+
+    def get(self, url, data, deadline=None, read_timeout=None, hedge=True):
+        if deadline is None:
+            deadline = self.deadline
+        t_end = time.monotonic() + deadline
+        attempt = 0
+        error = 'deadline exceeded'
+        while True:
+            remaining = t_end - time.monotonic()
+            if remaining <= 0:
+                # The backoff sleep overran what was left of the deadline
+                raise AlpacaError(f'GET {url} failed after {attempt} '
+                                  f'attempt(s): {error}')
+            self._count('requests')
+            r = None
+            try:
+                if hedge is True and self.hedge_after is not None\
+                   and remaining > self.hedge_after:
+                    r = self._hedged_get(url, data, remaining, read_timeout)
+                else:
+                    r = self._send('GET', url, data,
+                                   self._timeout(remaining, read_timeout))
+                if r.status_code < 500:
+                    return r
+                error = f'{r.status_code}: {r.text}'
+            except requests.Timeout as e:
+                self._count('timeouts')
+                error = f'timeout: {e}'
+            except requests.ConnectionError as e:
+                self._count('errors')
+                error = f'connection error: {e}'
+            attempt += 1
+            # Full jitter backoff, bounded by what is left of the deadline
+            delay = random.uniform(0, self.backoff * 2**attempt)
+            remaining = t_end - time.monotonic()
+            if attempt > self.retries or remaining <= delay:
+                if r is not None:
+                    # Let the caller report the server error
+                    return r
+                raise AlpacaError(f'GET {url} failed after {attempt} '
+                                  f'attempt(s): {error}')
+            log.debug(f'  Retry {attempt} of GET {url} in {delay:.2f} s '
+                      f'({error})')
+            self._count('retries')
+            time.sleep(delay)
+
+    def put(self, url, data, deadline=None, read_timeout=None):
+        if deadline is None:
+            deadline = self.deadline
+        self._count('requests')
+        try:
+            return self._send('PUT', url, data,
+                              self._timeout(deadline, read_timeout))
+        except requests.Timeout as e:
+            self._count('timeouts')
+            raise AlpacaError(f'PUT {url} timed out: {e}')
+        except requests.ConnectionError as e:
+            self._count('errors')
+            raise AlpacaError(f'PUT {url} failed: {e}')
+
+    def percentile(self, q, latencies=None):
+        """Latency (seconds) at percentile q (0-100) of recent requests."""
+        if latencies is None:
+            with self.lock:
+                latencies = list(self.latencies)
+        if len(latencies) == 0:
+            return None
+        ordered = sorted(latencies)
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def stats(self):
+        """Latency percentiles and counters for tuning the policy."""
+        with self.lock:
+            stats = dict(self.counts)
+            latencies = list(self.latencies)
+        for q in [50, 90, 99]:
+            stats[f'p{q}'] = self.percentile(q, latencies)
+        stats['max'] = max(latencies) if len(latencies) > 0 else None
+        return stats